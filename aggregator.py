@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import gzip
+import shutil
+import tempfile
+from datetime import datetime
+
+import pandas
+import pyarrow.parquet as pq
+
+from download_logs import add_counts
+from interning import DICTIONARIES, encode_counts, decode
+from sketches import IPSketches
+
+
+COUNT_COLUMNS = ['package', 'date', 'provider', 'country', 'ip_address']
+EXPORT_COLUMNS = ['date', 'package', 'provider', 'ip_address', 'country', 'path_information', 'user', 'name',
+                  'version', 'channel', 'revision', 'kind', 'package_id']
+
+
+class DownloadAggregator(object):
+    # Running download counts. The counts of each parsed log are folded in,
+    # so memory depends on the number of distinct values, not on the number of rows.
+    # Counts are indexed by the integer codes of the shared dictionaries in interning.py.
+
+    def __init__(self, columns=None):
+        self.columns = columns or COUNT_COLUMNS
+        self.total = 0
+        self.counts = {}
+        self.sketches = IPSketches()
+
+    def add(self, parsed):
+        # a log reduced by download_logs.ParsedLog, package and date are the same for all its rows
+        if not parsed.rows:
+            return
+        self.total += parsed.rows
+        counts = dict(parsed.counts)
+        counts['package'] = pandas.Series([parsed.rows], index=[parsed.package], dtype='int64')
+        counts['date'] = pandas.Series([parsed.rows], index=[pandas.Timestamp(parsed.date)], dtype='int64')
+        for column in self.columns:
+            if column in DICTIONARIES:
+                counts[column] = encode_counts(column, counts[column])
+            self.counts[column] = add_counts(self.counts.get(column), counts[column])
+        if 'ip_address' in self.columns:
+            self.sketches.add(parsed.package, parsed.date, counts['ip_address'])
+
+    def merge(self, other):
+        self.total += other.total
+        for column, counts in other.counts.items():
+            self.counts[column] = add_counts(self.counts.get(column), counts)
+        self.sketches.merge(other.sketches)
+
+    def pivot(self, column):
+        counts = self.counts[column]
+        pivot = pandas.Series(counts.values, index=decode(column, counts.index.values), name=column)
+        return pivot.sort_index()
+
+    def distinct(self, column):
+        return len(self.counts[column].index)
+
+    def date_range(self):
+        dates = self.counts['date'].index
+        return dates.min(), dates.max()
+
+
+class EventSink(object):
+    # Every parsed event of the finished days as one gzip CSV. The events of each parsed log are
+    # spooled to disk as they arrive, one file per package and day, a row group at a time; close
+    # writes them ordered by package and day. Logs finish in any order and the current day is still
+    # growing, so this and a fixed gzip header timestamp make the same days always give the same
+    # bytes, and an unchanged export is not uploaded again.
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._folder = None
+        # {(package, date): spool file}
+        self._parts = {}
+
+    def write(self, parsed):
+        # a log reduced by download_logs.ParsedLog
+        if not parsed.rows or parsed.date.date() >= datetime.utcnow().date():
+            return
+        if self._folder is None:
+            self._folder = tempfile.mkdtemp("events", "conan")
+        key = (parsed.package, parsed.date)
+        if key not in self._parts:
+            self._parts[key] = os.path.join(self._folder, "{}.csv".format(len(self._parts)))
+        events = pq.ParquetFile(parsed.events_file)
+        with open(self._parts[key], "a", newline="") as part:
+            for index in range(events.num_row_groups):
+                pd_frame = events.read_row_group(index).to_pandas()
+                pd_frame.insert(0, 'date', pandas.Timestamp(parsed.date))
+                pd_frame.insert(1, 'package', parsed.package)
+                pd_frame.to_csv(part, index=False, header=False, columns=EXPORT_COLUMNS)
+
+    def close(self):
+        with open(self.file_name, "wb") as raw:
+            # GzipFile does not close the file object it was given
+            with io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode="wb", mtime=0), newline="") as events:
+                if self._parts:
+                    pandas.DataFrame(columns=EXPORT_COLUMNS).to_csv(events, index=False)
+                for key in sorted(self._parts):
+                    with open(self._parts[key], newline="") as part:
+                        shutil.copyfileobj(part, events)
+        if self._folder:
+            shutil.rmtree(self._folder, ignore_errors=True)
+        self._folder = None
+        self._parts = {}
+        return self.file_name
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import gc
+import json
+import time
+import random
+import logging
+import argparse
+import resource
+import tempfile
+import importlib.util
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from tabulate import tabulate
+
+from synthetic_logs import SyntheticCatalog, LocalBintray, LocalLogSource, generate_dataset
+
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+# stage name -> (unit, setup(dataset) returning run() -> units processed)
+STAGES = OrderedDict()
+
+
+def stage(name, unit):
+    def register(setup):
+        STAGES[name] = (unit, setup)
+        return setup
+    return register
+
+
+def load_script(file_name):
+    spec = importlib.util.spec_from_file_location(file_name.replace("-", "_")[:-len(".py")],
+                                                  os.path.join(REPO, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def dataset_packages(dataset):
+    return sorted(name for name in os.listdir(dataset) if os.path.isdir(os.path.join(dataset, name)))
+
+
+def dataset_settings(dataset):
+    with open(os.path.join(dataset, "settings.json")) as json_file:
+        return json.load(json_file)
+
+
+def load_providers(script):
+    from ip_providers import read_providers
+    script.PROVIDERS = read_providers(os.path.join(REPO, "providers.json"), os.path.join(REPO, "amazon_ip_range.json"))
+
+
+@stage("show_package_downloads", "rows")
+def show_package_downloads(dataset):
+    script = load_script("conan-get-ip.py")
+    load_providers(script)
+    bintray = LocalBintray(dataset)
+
+    def run():
+        for package in dataset_packages(dataset):
+            script.show_package_downloads(bintray, "conan", "public-conan", package)
+        return script.TOTAL.total
+    return run
+
+
+@stage("get_provider", "lookups")
+def get_provider(dataset):
+    from download_logs import read_download_log
+    script = load_script("conan-get-ip.py")
+    load_providers(script)
+    addresses = []
+    for package in dataset_packages(dataset):
+        log = os.path.join(dataset, package, sorted(os.listdir(os.path.join(dataset, package)))[0])
+        for pd_frame in read_download_log(log, usecols=['ip_address']):
+            addresses.extend(pd_frame['ip_address'].astype(str))
+
+    def run():
+        for ip_address in addresses:
+            script.get_provider(ip_address)
+        return len(addresses)
+    return run
+
+
+@stage("get_package_logs", "MB")
+def get_package_logs(dataset):
+    from checkpoint import PackageCheckpoint
+    script = load_script("conan-statistics.py")
+    source = LocalLogSource(dataset)
+    size = sum(os.path.getsize(os.path.join(dataset, package, log)) for package in dataset_packages(dataset)
+               for log in os.listdir(os.path.join(dataset, package)))
+
+    def run():
+        for package in dataset_packages(dataset):
+            script.get_package_logs(source, PackageCheckpoint(package), "conan", "public-conan", package, "conan")
+        return size / float(1 << 20)
+    return run
+
+
+@stage("filter_package_info_by_version", "package ids")
+def filter_package_info_by_version(dataset):
+    script = load_script("conan-statistics.py")
+    settings = dataset_settings(dataset)
+    logs = {}
+    for package, items in settings.items():
+        # every binary downloaded on every day, plus ids the remote does not know
+        days = ["2019-06-{:02d}".format(day) for day in range(1, 8)]
+        versions = {item["recipe"]["id"].split("/")[1].split("@")[0]: item["packages"] for item in items}
+        logs[package] = {day: {version: dict([(binary["id"], 1) for binary in binaries] + [("unknown", 1)])
+                               for version, binaries in versions.items()} for day in days}
+
+    def run():
+        joined = 0
+        for package, items in settings.items():
+            joined += len(script.filter_package_info_by_version(logs[package], items))
+        return joined
+    return run
+
+
+@stage("merge_files", "files")
+def merge_files(dataset):
+    from partial_statistics import PartialStatistics, Breakdown
+    script = load_script("collect-results.py")
+    settings = dataset_settings(dataset)
+    randomizer = random.Random(0)
+    files = []
+    for shard in range(64):
+        partial = PartialStatistics(["shard{}".format(shard)])
+        for package, items in settings.items():
+            breakdown = Breakdown(randomizer.randint(0, 10000))
+            for item in items:
+                for binary in item["packages"]:
+                    for dimension in ("arch", "os"):
+                        breakdown.add(dimension, binary["settings"][dimension], randomizer.randint(0, 100))
+                    breakdown.add("compiler", "{} {}".format(binary["settings"]["compiler"],
+                                                             binary["settings"]["compiler.version"]),
+                                  randomizer.randint(0, 100))
+            partial.add_package(package, breakdown)
+        files.append({"name": partial.save("statistics-shard{}.json".format(shard))})
+
+    def run():
+        script.merge_files(files)
+        return len(files)
+    return run
+
+
+def run_stage(name, dataset, folder):
+    # runs in a fresh process, so ru_maxrss is the peak of this stage only
+    os.chdir(folder)
+    sys.stdout = open(os.devnull, "w")
+    logging.disable(logging.WARNING)
+    unit, setup = STAGES[name]
+    run = setup(dataset)
+    gc.collect()
+    setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    units = run()
+    seconds = time.perf_counter() - started
+    return {
+        "unit": unit,
+        "units": round(units, 3),
+        "seconds": round(seconds, 3),
+        "throughput": units / seconds if seconds else 0.0,
+        # kilobytes on Linux
+        "setup_rss_mb": round(setup_rss / 1024.0, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    # stages slower, or using more memory, than the baseline by more than tolerance
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("stages", {}).get(name)
+        if not previous:
+            continue
+        if result["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append("{}: {:.1f} {}/s, baseline {:.1f}".format(name, result["throughput"], result["unit"],
+                                                                         previous["throughput"]))
+        if result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance):
+            regressions.append("{}: peak RSS {} MB, baseline {} MB".format(name, result["peak_rss_mb"],
+                                                                          previous["peak_rss_mb"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the log processing stages on synthetic Bintray logs")
+    parser.add_argument("--rows", type=int, default=10000, help="rows of all logs together (10k to 100M)")
+    parser.add_argument("--packages", type=int, default=20)
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--dataset", help="folder of the generated logs, kept between runs of the same scale")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated, default: all")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--save-baseline", help="write the results of this run as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression ratio (default 0.2)")
+    args = parser.parse_args()
+
+    dataset = os.path.abspath(args.dataset or os.path.join(tempfile.gettempdir(), "conan-benchmark-{}-{}-{}".format(
+        args.rows, args.packages, args.days)))
+    if not os.path.exists(os.path.join(dataset, "settings.json")):
+        print("Generating {} rows in {}".format(args.rows, dataset))
+        generate_dataset(dataset, args.rows, SyntheticCatalog(args.packages), args.days)
+
+    results = OrderedDict()
+    context = multiprocessing.get_context("spawn")
+    for name in args.stages.split(","):
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            results[name] = executor.submit(run_stage, name, dataset, tempfile.mkdtemp("benchmark", "conan")).result()
+    print(tabulate([[name, result["units"], result["unit"], result["seconds"], round(result["throughput"], 1),
+                     result["setup_rss_mb"], result["peak_rss_mb"]] for name, result in results.items()],
+                   ["Stage", "Units", "Unit", "Seconds", "Units/s", "Setup RSS (MB)", "Peak RSS (MB)"], tablefmt="grid"))
+
+    current = {"rows": args.rows, "packages": args.packages, "days": args.days, "stages": results}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as json_file:
+            json.dump(current, json_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            baseline = json.load(json_file)
+        if (baseline.get("rows"), baseline.get("packages"), baseline.get("days")) != \
+           (args.rows, args.packages, args.days):
+            print("Warning: the baseline was measured on another scale")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        if regressions:
+            sys.exit(1)
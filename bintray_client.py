@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from bintray.bintray import Bintray
+from bintray.requester import Requester
+
+
+BINTRAY_TIMEOUT = float(os.getenv("BINTRAY_TIMEOUT", 60))
+BINTRAY_RETRIES = int(os.getenv("BINTRAY_RETRIES", 5))
+BINTRAY_BACKOFF_FACTOR = float(os.getenv("BINTRAY_BACKOFF_FACTOR", 1.0))
+BINTRAY_POOL_SIZE = int(os.getenv("BINTRAY_POOL_SIZE", 16))
+OWNERS_CACHE = os.getenv("BINTRAY_OWNERS_CACHE",
+                         os.path.join(os.path.expanduser("~"), ".conan-statistics", "owners.json"))
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# a local fixture server can stand in for the Bintray API
+Bintray.BINTRAY_URL = os.getenv("BINTRAY_URL", Bintray.BINTRAY_URL).rstrip("/")
+
+
+def backoff_delay(attempt):
+    # exponential backoff with jitter, so workers do not retry in lockstep
+    return BINTRAY_BACKOFF_FACTOR * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _rate_limited(response):
+    return response.status_code == 429 or \
+        (response.status_code == 403 and response.headers.get("X-RateLimit-Remaining") == "0")
+
+
+def _retry_after(response, attempt):
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return backoff_delay(attempt)
+
+
+class PooledRequester(Requester):
+    # Requester of bintray-python over one shared keep-alive session, with timeouts and retries.
+    # Connection errors and 5xx answers are retried with jittered backoff, rate limited answers
+    # wait for Retry-After when Bintray sends it.
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def session(cls):
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=BINTRAY_POOL_SIZE, pool_maxsize=BINTRAY_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._session = session
+            return cls._session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", BINTRAY_TIMEOUT)
+        kwargs.setdefault("auth", self._get_authentication())
+        attempt = 0
+        while True:
+            data = kwargs.get("data")
+            if attempt and hasattr(data, "seek"):
+                data.seek(0)
+            try:
+                response = PooledRequester.session().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt + 1 >= BINTRAY_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                logging.warning("{} {} failed ({}), retrying in {:.1f}s".format(method, url, error, delay))
+            else:
+                if attempt + 1 >= BINTRAY_RETRIES or \
+                   (response.status_code not in RETRY_STATUS and not _rate_limited(response)):
+                    return response
+                delay = _retry_after(response, attempt) if _rate_limited(response) else backoff_delay(attempt)
+                logging.warning("{} {} answered {}, retrying in {:.1f}s".format(method, url, response.status_code,
+                                                                              delay))
+            time.sleep(delay)
+            attempt += 1
+
+    def download(self, url, params=None, add_status_code=True):
+        response = self.request("GET", url, params=params)
+        if not response.ok:
+            self._raise_error("Could not GET", response)
+        if add_status_code:
+            return self._add_status_code(response), response.content
+        return response.content
+
+    def put(self, url, params=None, data=None, json=None, headers=None):
+        if data and json:
+            raise Exception("Only accept 'data' or 'json'")
+        if data:
+            response = self.request("PUT", url, params=params, data=data, headers=headers)
+        else:
+            response = self.request("PUT", url, params=params, json=json, headers=headers)
+        if not response.ok:
+            self._raise_error("Could not PUT", response)
+        return self._add_status_code(response)
+
+    def post(self, url, json=None, params=None, headers=None):
+        response = self.request("POST", url, json=json, params=params, headers=headers)
+        if not response.ok:
+            self._raise_error("Could not POST", response)
+        return self._add_status_code(response)
+
+    def patch(self, url, json=None, params=None):
+        response = self.request("PATCH", url, json=json, params=params)
+        if not response.ok:
+            self._raise_error("Could not PATCH", response)
+        return self._add_status_code(response)
+
+    def delete(self, url, params=None):
+        response = self.request("DELETE", url, params=params)
+        if not response.ok:
+            self._raise_error("Could not DELETE", response)
+        return self._add_status_code(response)
+
+
+def create_bintray(username=None, api_key=None):
+    bintray = Bintray(username, api_key)
+    bintray._requester = PooledRequester(bintray._username, bintray._password)
+    return bintray
+
+
+class OwnerCache(object):
+    # {"<name>:<user>": {"owner": ..., "repo": ...}} on disk, so only new packages cost a request
+
+    def __init__(self, file_name=OWNERS_CACHE):
+        self.file_name = file_name
+        self._owners = {}
+        if os.path.exists(file_name):
+            with open(file_name) as json_file:
+                self._owners = json.load(json_file)
+
+    def get(self, package):
+        return self._owners.get(package)
+
+    def put(self, package, json_data):
+        self._owners[package] = {"owner": json_data["owner"], "repo": json_data["repo"]}
+
+    def save(self):
+        folder = os.path.dirname(self.file_name)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        fd, temp_name = tempfile.mkstemp(dir=folder or None, suffix=".tmp")
+        with os.fdopen(fd, "w") as json_file:
+            json.dump(self._owners, json_file)
+        os.replace(temp_name, self.file_name)
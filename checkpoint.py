@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import sqlite3
+import datetime
+import pandas
+
+from download_logs import add_counts
+from download_cube import DownloadCube
+from interning import DICTIONARIES, MISSING
+from sketches import IPSketches
+
+
+CHECKPOINT_FILE = os.getenv("CONAN_CHECKPOINT",
+                            os.path.join(os.path.expanduser("~"), ".conan-statistics", "checkpoint.sqlite"))
+# runs with the same name resume each other, by default every run of the same day
+CHECKPOINT_RUN = os.getenv("CONAN_CHECKPOINT_RUN", datetime.date.today().strftime("%Y%m%d"))
+CHECKPOINT_VERSION = 1
+
+
+class PackageCheckpoint(object):
+    # Everything one package adds to the totals of a run: its cube cells, IP sketches and
+    # downloads by IP address
+
+    def __init__(self, name):
+        self.name = name
+        self.cube = DownloadCube()
+        self.sketches = IPSketches()
+        self.ip_counts = pandas.Series([], dtype='int64')
+
+    def add_ip_counts(self, ip_counts):
+        # downloads by IP code
+        self.ip_counts = add_counts(self.ip_counts, ip_counts[ip_counts.index != MISSING])
+
+    def to_dict(self):
+        addresses = DICTIONARIES['ip_address'].decode(self.ip_counts.index.values)
+        return {
+            "version": CHECKPOINT_VERSION,
+            "name": self.name,
+            "cube": self.cube.to_dict(),
+            "sketches": self.sketches.to_dict(),
+            "ip_addresses": dict(zip(addresses, [int(count) for count in self.ip_counts.values])),
+        }
+
+    @staticmethod
+    def from_dict(data):
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise Exception("Unsupported checkpoint version: {}".format(data.get("version")))
+        checkpoint = PackageCheckpoint(data["name"])
+        checkpoint.cube = DownloadCube.from_dict(data["cube"])
+        checkpoint.sketches = IPSketches.from_dict(data["sketches"])
+        addresses = list(data["ip_addresses"].keys())
+        codes = DICTIONARIES['ip_address'].encode(pandas.Series(addresses, dtype=object))
+        checkpoint.ip_counts = pandas.Series([data["ip_addresses"][address] for address in addresses], index=codes,
+                                             dtype='int64')
+        return checkpoint
+
+
+class CheckpointJournal(object):
+    # Finished packages of a run in SQLite. Each package is committed as soon as it is done
+    # (WAL mode, so a crash loses at most the package in progress); a restarted run loads
+    # them instead of downloading and parsing their logs again.
+
+    def __init__(self, file_name=CHECKPOINT_FILE, run=CHECKPOINT_RUN):
+        folder = os.path.dirname(file_name)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.run = run
+        self._connection = sqlite3.connect(file_name, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS packages "
+                                     "(run TEXT, name TEXT, finished REAL, data TEXT, PRIMARY KEY (run, name))")
+            # checkpoints of older runs are never resumed
+            self._connection.execute("DELETE FROM packages WHERE run != ?", (run,))
+
+    def load(self, name):
+        row = self._connection.execute("SELECT data FROM packages WHERE run = ? AND name = ?",
+                                       (self.run, name)).fetchone()
+        return PackageCheckpoint.from_dict(json.loads(row[0])) if row else None
+
+    def save(self, checkpoint):
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?)",
+                                     (self.run, checkpoint.name, time.time(), json.dumps(checkpoint.to_dict())))
+
+    def finished(self):
+        return [row[0] for row in self._connection.execute("SELECT name FROM packages WHERE run = ? ORDER BY name",
+                                                           (self.run,))]
+
+    def close(self):
+        self._connection.close()
@@ -3,67 +3,100 @@
 
 import os
 import datetime
-import json
-from bintray.bintray import Bintray
+from bintray_client import create_bintray
+from sketches import merge_sketch_files
+from partial_statistics import merge_partial_files
+from download_cube import merge_cube_files
+from snapshot import write_snapshot
+from uploads import UploadPipeline, check_uploads
+from instrumentation import span
+import instrumentation
 
 
 def get_file_list():
-    bintray = Bintray()
+    bintray = create_bintray()
     remote = os.getenv("BINTRAY_REMOTE")
     subject, repo, package = remote.split('/')
     return bintray.get_package_files(subject, repo, package)
 
 
-def filter_file_list(files):
+def filter_file_list(files, prefix="statistics-"):
     today = datetime.date.today()
     version = today.strftime("%Y%m%d")
     filtered_list = []
     for file in files:
         if file.get("version") == version and \
+           file.get("name").startswith(prefix) and \
            ".json" in file.get("name") and \
-           "statistics-total" not in file.get("name"):
+           "{}total".format(prefix) not in file.get("name"):
             filtered_list.append(file)
     return filtered_list
 
 
 def download_files(files):
-    bintray = Bintray()
+    bintray = create_bintray()
     remote = os.getenv("BINTRAY_REMOTE")
     subject, repo, package = remote.split('/')
     for file in files:
         file_path = file.get("path")
         file_name = file.get("name")
-        bintray.download_content(subject, repo, file_path, file_name)
+        with span("download", file=file_name) as timing:
+            bintray.download_content(subject, repo, file_path, file_name)
+            timing.add("bytes", os.path.getsize(file_name))
 
 
 def merge_files(files):
-    total = {}
-    for file in files:
-        name = file.get("name")
-        with open(name, 'rb') as json_fd:
-            json_content = json.load(json_fd)
-            total = {k: total.get(k, 0) + json_content.get(k, 0) for k in set(total) | set(json_content)}
     today = datetime.date.today()
     version = today.strftime("%Y%m%d")
     file_name = "statistics-total-{}.json".format(version)
-    with open(file_name, 'w') as json_file:
-        json.dump(total, json_file)
-    return file_name
+    return merge_partial_files([file.get("name") for file in files]).save(file_name)
+
+
+def merge_sketches(files):
+    today = datetime.date.today()
+    version = today.strftime("%Y%m%d")
+    file_name = "sketches-total-{}.json".format(version)
+    return merge_sketch_files([file.get("name") for file in files]).save(file_name)
+
+
+def merge_cubes(files):
+    # the merged cube, its binary snapshot and the downloads.csv table derived from it
+    today = datetime.date.today()
+    version = today.strftime("%Y%m%d")
+    cube = merge_cube_files([file.get("name") for file in files])
+    table_name = "downloads-{}.csv".format(version)
+    cube.downloads_table().to_csv(table_name)
+    snapshot_name = write_snapshot(cube, "cube-total-{}.snap".format(version))
+    return cube.save("cube-total-{}.json".format(version)), snapshot_name, table_name
 
 
-def upload_file(file):
+def create_upload_pipeline():
     remote = os.getenv("BINTRAY_REMOTE")
     subject, repo, package = remote.split('/')
-    bintray = Bintray()
     today = datetime.date.today()
     version = today.strftime("%Y%m%d")
-    basename = os.path.basename(file)
-    bintray.upload_content(subject, repo, package, version, basename, file, override=True)
+    return UploadPipeline(create_bintray(), subject, repo, package, version)
 
 
 if __name__ == "__main__":
-    files = get_file_list()
+    instrumentation.start("collect-results")
+    with span("list"):
+        files = get_file_list()
     filtered_files = filter_file_list(files)
-    download_files(filtered_files)
-    total_path = merge_files(filtered_files)
-    upload_file(total_path)
+    sketch_files = filter_file_list(files, "sketches-")
+    cube_files = filter_file_list(files, "cube-")
+    download_files(filtered_files + sketch_files + cube_files)
+    uploads = create_upload_pipeline()
+    with span("merge_statistics") as timing:
+        uploads.add(merge_files(filtered_files))
+        timing.add("files", len(filtered_files))
+    if sketch_files:
+        with span("merge_sketches") as timing:
+            uploads.add(merge_sketches(sketch_files))
+            timing.add("files", len(sketch_files))
+    if cube_files:
+        with span("merge_cubes") as timing:
+            for file_name in merge_cubes(cube_files):
+                uploads.add(file_name)
+            timing.add("files", len(cube_files))
+    check_uploads(uploads.run())
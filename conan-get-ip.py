@@ -1,27 +1,34 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import os
 import tempfile
+import functools
 import gzip
 import shutil
-from bisect import bisect_left
-import pandas
+import logging
 import humanfriendly
-import json
 from datetime import datetime
-from ipaddress import IPv4Address, IPv4Network
-from bintray.bintray import Bintray
+from bintray_client import create_bintray
+from ip_providers import read_providers
+from download_logs import parse_download_log
+from aggregator import DownloadAggregator, EventSink
+from log_fetcher import LogFetcher, fetch_package_logs
+from log_cache import LogCache, CachedParse
+from warehouse import Warehouse
+from rollups import Rollups
+from uploads import UploadPipeline, check_uploads
+from instrumentation import span
+import instrumentation
 
 
-TOTAL_FRAMES = []
 PROVIDERS = None
 
 
-def uncompress(src, dst):
-    with open(dst, "wb") as fd_dst:
-        with gzip.open(src, "rb") as fd_src:
-            bindata = fd_src.read()
-            fd_dst.write(bindata)
+def today():
+    return datetime.now().strftime("%d-%m-%Y")
+
+
+TOTAL = DownloadAggregator()
+EVENTS = EventSink("conan-center-{}.csv.gz".format(today()))
 
 
 def compress(file_name):
@@ -34,22 +41,11 @@ def compress(file_name):
 
 def load_providers():
     global PROVIDERS
-    with open("providers.json") as json_file:
-        PROVIDERS = json.load(json_file)
+    PROVIDERS = read_providers()
 
 
 def get_provider(ip_address):
-    for provider, ips in PROVIDERS.items():
-        index = bisect_left(ips, ip_address)
-        if index != len(ips) and ips[index] == ip_address:
-            return provider
-
-        if provider == "Azure" or provider == "Amazon":
-            for prefix_ip in ips:
-                if IPv4Address(ip_address) in IPv4Network(prefix_ip):
-                    return provider
-
-    return "Unknown"
+    return PROVIDERS.lookup(ip_address)
 
 
 def show_quota(bintray, organization):
@@ -62,73 +58,98 @@ def show_quota(bintray, organization):
     print("Monthly Free Downloads Quota Limit: {}".format(humanfriendly.format_size(response["monthly_free_downloads_quota_limit"])))
 
 
-def today():
-    return datetime.now().strftime("%d-%m-%Y")
-
-
 def show_total():
-    pd_block = pandas.concat(TOTAL_FRAMES, axis=0, ignore_index=True)
-    size = len(pd_block.index)
     print("=== TOTAL ===")
-    print("Downloads Total: {}".format(size))
-    #print("Providers: {}".format(pd_block.pivot_table(index=['provider'], aggfunc='size')))
-    print("Countries: {}".format(pd_block.pivot_table(index=['country'], aggfunc='size')))
-    print("IPs: {}".format(pd_block.pivot_table(index=['ip_address'], aggfunc='size')))
-    file_name = "conan-center-{}.csv.gz".format(today())
-    pd_block.to_csv(file_name, index=False, compression='gzip')
-    return file_name
-
-
-def show_package_downloads(bintray, organization, repo, package):
+    print("Downloads Total: {}".format(TOTAL.total))
+    if TOTAL.total:
+        print("Providers: {}".format(TOTAL.pivot('provider')))
+        print("Countries: {}".format(TOTAL.pivot('country')))
+        print("Unique IPs (estimated): {}".format(TOTAL.sketches.unique()))
+        print("Top IPs: {}".format(TOTAL.sketches.top()))
+    TOTAL.sketches.save("conan-center-sketches-{}.json".format(today()))
+    return EVENTS.close()
+
+
+def count_package_downloads(aggregator, parsed):
+    with span("aggregate") as timing:
+        aggregator.add(parsed)
+        EVENTS.write(parsed)
+        timing.add("rows", parsed.rows)
+
+
+def print_package_downloads(package, aggregator):
+    TOTAL.merge(aggregator)
+    print("Package: {}".format(package))
+    print("Downloads Total: {}".format(aggregator.total))
+    if aggregator.total:
+        print("Date range {} - {}".format(*aggregator.date_range()))
+        print("Providers: {}".format(aggregator.pivot('provider')))
+        print("Countries: {}".format(aggregator.pivot('country')))
+        print("IPs: {}".format(aggregator.pivot('ip_address')))
+
+
+def parse_package_log(cache=None):
+    parse = functools.partial(parse_download_log, providers=PROVIDERS)
+    return CachedParse(cache, parse, "parsed-{}".format(PROVIDERS.digest))
+
+
+def store_package_day(parsed, warehouse=None, rollups=None):
+    if warehouse:
+        with span("warehouse", package=parsed.package):
+            warehouse.append(parsed.package, parsed.date, parsed.events_file)
+    if rollups:
+        with span("rollups", package=parsed.package):
+            rollups.add_log(parsed)
+
+
+def show_package_downloads(bintray, organization, repo, package, cache=None, warehouse=None, rollups=None):
+    # like fetch_package_logs, a package or a log Bintray fails to give is skipped, any other error is raised
+    print("Package {}".format(package))
+    parse = parse_package_log(cache)
+    fetcher = LogFetcher(bintray, tempfile.mkdtemp(package, organization), cache=cache)
     try:
-        global TOTAL_FRAMES
-        to_be_downloaded = []
-        print("Package {}".format(package))
-        response = bintray.get_list_package_download_log_files(organization, repo, package)
-        for log in response:
-            if "name" in log and "csv.gz" in log["name"]:
-                to_be_downloaded.append(log["name"])
-
-        if to_be_downloaded:
-            temp_folder = tempfile.mkdtemp(package, organization)
-            pd_list = []
-            for file in to_be_downloaded:
-                local_name = os.path.join(temp_folder, file)
-                dst_name = local_name[:-3]
-                bintray.download_package_download_log_file(organization, repo, package, file, local_name)
-                uncompress(local_name, dst_name)
-                usecols = ['ip_address', 'country', 'path_information']
-                pd_frame = pandas.read_csv(dst_name, usecols=usecols)
-                date = os.path.basename(dst_name)[10:-4]
-                date = datetime.strptime(date, '%d-%m-%Y')
-                pd_frame.insert(0, 'date', date)
-                pd_frame.insert(1, 'package', package)
-                #pd_frame.insert(2, 'provider', "Unknown")
-                for index, row in pd_frame.iterrows():
-                    pd_frame.at[index, 'path_information'] = os.path.basename(row.path_information)
-                pd_list.append(pd_frame)
-                TOTAL_FRAMES.append(pd_frame)
-            pd_block = pandas.concat(pd_list, axis=0, ignore_index=True)
-            pd_block.sort_values(by='date')
-
-            #for ip, count in pd_block.pivot_table(index=['ip_address'], aggfunc='size').items():
-            #    provider = get_provider(ip)
-            #    pd_block.loc[pd_block.ip_address == ip, 'provider'] = provider
-
-            size = len(pd_block.index)
-
-            print("Package: {}".format(package))
-            print("Downloads Total: {}".format(size))
-            print("Date range {} - {}".format(pd_block.at[0, "date"], pd_block.at[size-1, "date"]))
-            #print("Providers: {}".format(pd_block.pivot_table(index=['provider'], aggfunc='size')))
-            print("Countries: {}".format(pd_block.pivot_table(index=['country'], aggfunc='size')))
-            print("IPs: {}".format(pd_block.pivot_table(index=['ip_address'], aggfunc='size')))
-    except:
-        pass
-
-
-def upload_file():
-    pass
+        to_be_downloaded = fetcher.list_logs(organization, repo, package)
+    except Exception:
+        logging.exception("Could not list logs of {}".format(package))
+        return
+    if to_be_downloaded:
+        aggregator = DownloadAggregator()
+        for file in to_be_downloaded:
+            try:
+                local_name = fetcher.download_log(organization, repo, package, file)
+            except Exception:
+                logging.exception("Could not download {} of {}".format(file, package))
+                continue
+            with span("parse", package=package, file=file):
+                parsed = parse(local_name, package)
+            count_package_downloads(aggregator, parsed)
+            if parsed.rows:
+                store_package_day(parsed, warehouse, rollups)
+        print_package_downloads(package, aggregator)
+
+
+def show_packages_downloads(bintray, targets, cache=None, warehouse=None, rollups=None):
+    # Fetch logs of many packages at once and parse them on a process pool
+    aggregators = {}
+
+    def consume(target, parsed):
+        if parsed.rows:
+            count_package_downloads(aggregators.setdefault(target, DownloadAggregator()), parsed)
+            store_package_day(parsed, warehouse, rollups)
+
+    def finish(target):
+        if target in aggregators:
+            print_package_downloads(target[2], aggregators.pop(target))
+
+    fetcher = LogFetcher(bintray, tempfile.mkdtemp("logs", "conan"), cache=cache)
+    fetch_package_logs(fetcher, targets, parse_package_log(cache), consume, finish)
+
+
+def upload_files(bintray, files):
+    pipeline = UploadPipeline(bintray, "uilianries", "generic", "statistics", today())
+    for file in files:
+        pipeline.add(file)
+    return check_uploads(pipeline.run())
 
 
 def get_packages(bintray, organization, repo):
@@ -148,14 +169,28 @@ def get_packages(bintray, organization, repo):
 
 
 if __name__ == "__main__":
-    bintray = Bintray()
-    packages = get_packages(bintray, "conan", "conan-center")
+    instrumentation.start("conan-get-ip")
+    with span("providers"):
+        load_providers()
+    bintray = create_bintray()
+    with span("packages"):
+        packages = get_packages(bintray, "conan", "conan-center")
+    targets = []
     for package in packages:
         name = package.get("name") or ""
         if ":conan" in name:
-            show_package_downloads(bintray, "conan-community", "conan", name)
+            targets.append(("conan-community", "conan", name))
         elif ":bincrafters" in name:
-            show_package_downloads(bintray, "bincrafters", "public-conan", name)
-    file_name = show_total()
-    bintray.upload_content("uilianries", "generic", "statistics", today(), file_name, file_name,
-                           override=True)
+            targets.append(("bincrafters", "public-conan", name))
+    cache = LogCache()
+    warehouse = Warehouse()
+    rollups = Rollups()
+    with span("rollups"):
+        rollups.backfill(warehouse)
+    with span("logs"):
+        show_packages_downloads(bintray, targets, cache, warehouse, rollups)
+    cache.evict()
+    rollups.close()
+    with span("total"):
+        file_name = show_total()
+    upload_files(bintray, [file_name, "conan-center-sketches-{}.json".format(today())])
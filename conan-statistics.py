@@ -1,242 +1,181 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import json
-import magic
 import os
 import sys
-import requests
 import logging
-import gzip
-import glob
 import time
 import datetime
 import time
-import pandas
 import tempfile
 import uuid
 from collections import defaultdict
 
 from tabulate import tabulate
 from requests.auth import HTTPBasicAuth
-from selenium import webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from bs4 import BeautifulSoup
-from selenium.webdriver.firefox.options import Options
-from conans.client import conan_api
 from conans.model.ref import ConanFileReference
-from selenium.common.exceptions import NoSuchElementException
 from bintray.bintray import Bintray
-
-
-TOTAL_DOWNLOADS = 0
-IP_ADDRESSES = []
-TOTAL_ARCH = defaultdict(int)
-TOTAL_COMPILER = defaultdict(int)
-TOTAL_OS = defaultdict(int)
+from bintray_client import PooledRequester, OwnerCache, create_bintray
+from download_logs import parse_package_downloads, log_date, add_counts
+from log_cache import LogCache, CachedParse
+from interning import DICTIONARIES, encode_counts
+from sketches import IPSketches
+from conan_metadata import ConanMetadata
+from log_sources import create_log_source
+from sharding import PackageCosts, iterate_recipes, release_recipes, paginate_recipe_list, WORK_QUEUE
+from partial_statistics import PartialStatistics, PackageResults
+from download_cube import DownloadCube, settings_coordinates
+from checkpoint import CheckpointJournal, PackageCheckpoint
+from uploads import UploadPipeline, check_uploads
+from instrumentation import span
+import instrumentation
+
+
+# one shard per job and day, the name of its partial results
+SHARD = "{}_{}".format(datetime.date.today().strftime("%Y%m%d"), os.getenv("CIRCLE_JOB", uuid.uuid4()))
+if WORK_QUEUE:
+    # the workers of a queue run in the same job, each one uploads its own files; not the pid,
+    # workers in different containers may share it
+    SHARD = "{}_{}".format(SHARD, uuid.uuid4().hex[:12])
+STATISTICS = PartialStatistics([SHARD])
+CUBE = DownloadCube()
+RESULTS = PackageResults("results-{}.jsonl".format(SHARD))
+# downloads by IP address code
+IP_COUNTS = None
+SKETCHES = IPSketches()
 TOTAL_CLIENT = defaultdict(int)
 FORMAT = '%(asctime)-15s: %(message)s'
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 
 
-def create_browser():
-    profile = webdriver.FirefoxProfile()
-    profile.set_preference('browser.download.folderList', 2)
-    profile.set_preference('browser.download.manager.showWhenStarting', False)
-    profile.set_preference('browser.download.dir', '/srv/download')
-    profile.set_preference("browser.download.manager.alertOnEXEOpen", False)
-    profile.set_preference("browser.download.manager.closeWhenDone", False)
-    profile.set_preference("browser.download.manager.focusWhenStarting", False)
-    profile.set_preference('browser.download.dir', '/tmp')
-    profile.set_preference('browser.helperApps.neverAsk.saveToDisk', 'application/octet-stream')
-    options = Options()
-    options.headless = True
-    browser = webdriver.Firefox(profile, options=options)
-    return browser
-
-
-def get_recipe_list_from_bintray(remote="conan-center"):
-    instance, _, _ = conan_api.Conan.factory()
-    packages = instance.search_recipes("*", remote_name=remote)
+def get_recipe_list_from_bintray(metadata):
+    packages = metadata.search_recipes("*")
     return [recipe["recipe"]["id"] for recipe in packages["results"][0]["items"]]
 
 
-def paginate_recipe_list(recipe_list):
-    total_pages = int(os.getenv("CONAN_TOTAL_PAGES", 0))
-    current_page = int(os.getenv("CONAN_CURRENT_PAGE", 0))
-    if total_pages and current_page:
-        names = set()
-        for recipe in recipe_list:
-            conan_ref = ConanFileReference.loads(recipe)
-            names.add(conan_ref.name)
-
-        names = list(names)
-        avg = len(names) / float(total_pages)
-        chunks = []
-        last = 0.0
-        while last < len(names):
-            chunks.append(names[int(last):int(last + avg)])
-            last += avg
-        chunk = chunks[current_page - 1]
-
-        filtered_list = []
-        for name in chunk:
-            for recipe in recipe_list:
-                if name in recipe:
-                    filtered_list.append(recipe)
-        recipe_list = filtered_list
-    return recipe_list
-
-
 def filter_recipe_list_by_name(recipe_list):
     recipes = defaultdict(list)
-    recipe_list = paginate_recipe_list(recipe_list)
     for recipe in recipe_list:
         conan_ref = ConanFileReference.loads(recipe)
         recipes[conan_ref.name].append(conan_ref.full_repr())
     return recipes
 
 
-def get_package_info_from_bintray(reference, remote="conan-center"):
-    instance, _, _ = conan_api.Conan.factory()
-    packages = instance.search_packages(reference, remote_name=remote)
-    return packages["results"][0]["items"]
+def get_package_info_from_bintray(metadata, references):
+    packages = []
+    for items in metadata.search_packages(references).values():
+        packages.extend(items)
+    return packages
+
+
+def index_package_settings(packages_from_api):
+    # [{'recipe': {'id': 'protobuf/3.6.1@bincrafters/stable'}, 'packages': [{'id': ..., 'settings': ...}, ...]}, ...]
+    # -> {('3.6.1', '2bb76c9adac7b8cd7c5e3b377ac9f06934aba606'): {'os': 'Linux', ...}, ...}
+    index = {}
+    for package in packages_from_api:
+        version = ConanFileReference.loads(package["recipe"]["id"]).version
+        for data in package['packages']:
+            index.setdefault((version, data['id']), data['settings'])
+    return index
 
 
 def filter_package_info_by_version(packages_from_logs, packages_from_api):
+    # {'2019-06-26': {'3.5.2': {'2bb76c9adac7b8cd7c5e3b377ac9f06934aba606': 17, ...
+    # -> [('2019-06-26', '3.5.2', {'os': 'Linux', ...}, 17), ...]
+    index = index_package_settings(packages_from_api)
     settings = []
-    # {'3.5.2': {'2bb76c9adac7b8cd7c5e3b377ac9f06934aba606': 17, ...
-    # The bad
-    for version in packages_from_logs.keys():
-        # [{'recipe': {'id': 'protobuf/3.6.1@bincrafters/stable'}, 'packages' ...F
-        # The ugly
-        for package in packages_from_api:
-            ref = ConanFileReference.loads(package["recipe"]["id"])
-            if ref.version == version:
-                # The mess!
-                for package_id in packages_from_logs[version].keys():
-                    # binary package from conan api
-                    for data in package['packages']:
-                        if data['id'] == package_id:
-                            data['settings']['downloads'] = packages_from_logs[version][package_id]
-                            settings.append({
-                                package_id: data['settings']
-                            })
-                            break
+    missing = set()
+    for date, versions in packages_from_logs.items():
+        for version, package_ids in versions.items():
+            for package_id, downloads in package_ids.items():
+                package_settings = index.get((version, package_id))
+                if package_settings is None:
+                    missing.add("{}:{}".format(version, package_id))
+                    continue
+                settings.append((date, version, package_settings, downloads))
+    if missing:
+        logging.warning("Downloaded packages without binary information ({}): {}".format(len(missing),
+                                                                                         sorted(missing)))
     return settings
 
 
-def print_statistics(name, settings):
-    global TOTAL_COMPILER
-    global TOTAL_ARCH
-    global TOTAL_OS
-    global TOTAL_DOWNLOADS
-
-    arch = defaultdict(int)
-    compiler = defaultdict(int)
-    os = defaultdict(int)
-    total = 0
-    for data in settings:
-        for value in data.values():
-            # in case of installer package
-            arch_key = "arch_build" if "arch_build" in value else "arch"
-            os_key = "os_build" if "os_build" in value else "os"
-
-            downloads = value["downloads"]
-            total += downloads
-            TOTAL_DOWNLOADS += downloads
-
-            # header-only
-            if "arch" not in value and \
-               "compiler" not in value and \
-               "arch_build" not in value and \
-               "os" not in value and \
-               "os_build" not in value:
-                continue
+def add_package_downloads(checkpoint, settings):
+    for date, version, package_settings, downloads in settings:
+        coordinates = settings_coordinates(package_settings)
+        coordinates.update({'package': checkpoint.name, 'version': version, 'date': date})
+        checkpoint.cube.add(coordinates, downloads)
+
 
-            if arch_key in value:
-                arch[value[arch_key]] += downloads
-                TOTAL_ARCH[value[arch_key]] += downloads
+def merge_package_checkpoint(checkpoint):
+    global IP_COUNTS
+    CUBE.merge(checkpoint.cube)
+    SKETCHES.merge(checkpoint.sketches)
+    IP_COUNTS = add_counts(IP_COUNTS, checkpoint.ip_counts)
 
-            if os_key in value:
-                os[value[os_key]] += downloads
-                TOTAL_OS[value[os_key]] += downloads
 
-            if "compiler" in value:
-                compiler_name = "{} {}".format(value["compiler"], value["compiler.version"])
-                compiler[compiler_name] += downloads
-                TOTAL_COMPILER[compiler_name] += downloads
+def print_statistics(name, checkpoint):
+    # the package cube holds this package only, the global one is not scanned
+    package = checkpoint.cube.breakdown()
+    STATISTICS.add_package(name, package)
+    RESULTS.write(name, package)
 
     print("===== %s =====" % name.upper())
     generic_list = []
-    for key, value in arch.items():
+    for key, value in package.counts("arch").items():
         generic_list.append([key, value])
     if generic_list:
         print(tabulate(generic_list, ["Arch", "Downloads"], tablefmt="grid"))
 
     generic_list = []
-    for key, value in compiler.items():
+    for key, value in package.counts("compiler").items():
         generic_list.append([key, value])
     if generic_list:
         print(tabulate(generic_list, ["Compiler", "Downloads"], tablefmt="grid"))
 
     generic_list = []
-    for key, value in os.items():
+    for key, value in package.counts("os").items():
         generic_list.append([key, value])
     if generic_list:
         print(tabulate(generic_list, ["OS", "Downloads"], tablefmt="grid"))
 
-    print("TOTAL: {}".format(total))
+    print("TOTAL: {}".format(package.downloads))
 
 
 def print_total_statistics():
+    total = STATISTICS.total
     print("===== TOTAL =====")
     generic_list = []
-    for key, value in TOTAL_ARCH.items():
+    for key, value in total.counts("arch").items():
         generic_list.append([key, value])
     print(tabulate(generic_list, ["Arch", "Downloads"], tablefmt="grid"))
 
     generic_list = []
-    for key, value in TOTAL_COMPILER.items():
+    for key, value in total.counts("compiler").items():
         generic_list.append([key, value])
     print(tabulate(generic_list, ["Compiler", "Downloads"], tablefmt="grid"))
 
     generic_list = []
-    for key, value in TOTAL_OS.items():
+    for key, value in total.counts("os").items():
         generic_list.append([key, value])
     print(tabulate(generic_list, ["OS", "Downloads"], tablefmt="grid"))
 
-    print("TOTAL: {}\n".format(TOTAL_DOWNLOADS))
+    print("TOTAL: {}\n".format(total.downloads))
 
-    print(TOTAL_ARCH)
-    print(TOTAL_COMPILER)
-    print(TOTAL_OS)
+    print(total.counts("arch"))
+    print(total.counts("compiler"))
+    print(total.counts("os"))
 
 
 def upload_total_statistics():
-    total_address = defaultdict(int)
-    for address in IP_ADDRESSES:
-        total_address[get_ip_owner(address)] += 1
-
-    total = [
-        TOTAL_ARCH,
-        TOTAL_COMPILER,
-        TOTAL_OS,
-        total_address,
-        {"total": TOTAL_DOWNLOADS},
-    ]
+    # each distinct address is resolved once
+    ip_counts = IP_COUNTS if IP_COUNTS is not None else {}
+    for address, count in ip_counts.items():
+        STATISTICS.total.add("ip_owner", get_ip_owner(DICTIONARIES['ip_address'].decode_one(address)), int(count))
 
-    today = datetime.date.today()
-    date = today.strftime("%Y%m%d")
-    unique = uuid.uuid4()
-    job = os.getenv("CIRCLE_JOB", unique)
-    filename = "statistics-{}_{}.json".format(date, job)
-
-    with open(filename, 'w') as outfile:
-        json.dump(total, outfile)
-
-    upload_file(filename)
+    upload_files([STATISTICS.save("statistics-{}.json".format(SHARD)),
+                  SKETCHES.save("sketches-{}.json".format(SHARD)),
+                  CUBE.save("cube-{}.json".format(SHARD)),
+                  RESULTS.close()])
 
 
 def get_recipe_list_from_file(file_path):
@@ -245,105 +184,49 @@ def get_recipe_list_from_file(file_path):
         return [recipe["recipe"]["id"] for recipe in data["results"][0]["items"]]
 
 
-def login(browser):
-    username = os.getenv("BINTRAY_USERNAME")
-    password = os.getenv("BINTRAY_PASSWORD")
-    if not username or not password:
-        raise Exception("Login failed! BINTRAY_USERNAME and BINTRAY_PASSWORD must be configured!")
-    login_url = "https://bintray.com/login?forwardedFrom=%2F"
-    retry_limit = 10
-    while True:
-        retry = 0
-        browser.get(login_url)
-        browser_title = browser.title
-        browser.find_element_by_id("username").send_keys(username)
-        browser.find_element_by_id("password").send_keys(password)
-        browser.find_element_by_class_name("btn").click()
-
-        while browser_title == browser.title:
-            time.sleep(1)
-            retry += 1
-            if retry == retry_limit:
-                break
-
-        if browser_title != browser.title:
-            break
-
-    return browser
-
-
-def download_file(browser, url):
-    while True:
-        url_path = os.path.join("/tmp", url)
-        if os.path.exists(url_path):
-            os.remove(url_path)
-
-        while True:
-            try:
-                browser.find_element_by_link_text(url).click()
-                break
-            except NoSuchElementException:
-                browser.refresh()
-                WebDriverWait(browser, 60).until(EC.presence_of_element_located((By.LINK_TEXT, 'Download Logs'))).click()
-
-        # wait for download
-        while not os.path.exists(url_path):
-            time.sleep(1)
-        while os.path.exists(url_path + ".crdownload"):
-            time.sleep(1)
-        while os.path.exists(url_path + ".part"):
-            time.sleep(1)
-        if magic.from_file(url_path, mime=True) == 'application/gzip':
-            break
-
-
-def get_package_logs(browser, subject, repo, package, user):
-    # remove temporary files
-    for gz_file in glob.glob(os.path.join("/tmp", "*.csv.gz")):
-        os.remove(gz_file)
-    browser.get("https://bintray.com/{}/{}/{}%3A{}#statistics".format(subject, repo, package, user))
-    WebDriverWait(browser, 60).until(
-        EC.presence_of_element_located((By.LINK_TEXT, 'Download Logs'))).click()
-    soup = BeautifulSoup(browser.page_source, 'html.parser')
-    packages = defaultdict(dict)
-    for link in soup.find_all('a'):
-        # look for csv files on statistics page
-        if "href" in link.attrs and "csv.gz" in link.attrs['href']:
-            href = link.attrs['href']
-            # extract file name
-            url = href[href.rfind('=') + 1:]
-            download_file(browser, url)
-            with gzip.open(os.path.join("/tmp", url), 'rb') as gzip_file:
-                content = gzip_file.read()
-                with open("temp.csv", 'wb') as temp_csv:
-                    temp_csv.write(content)
-                values = content.decode().split(',')
-                # filter only package download
-                values = [value for value in values if "conan_package.tgz" in value]
-                for value in values:
-                    # /bincrafters/public-conan/bincrafters/protobuf/3.5.1/stable/0/package/8cf01e2f50fcd6b63525e70584df0326550364e1/0/conan_package.tgz
-                    value = value.split('/')
-                    version = value[5]
-                    package_id = value[9]
-                    packages[version][package_id] = packages[version].get(package_id, 0) + 1
-                global IP_ADDRESSES
-                IP_ADDRESSES = collect_ips("temp.csv")
+def get_package_logs(source, checkpoint, subject, repo, package, user, cache=None):
+    # {date: {version: {package_id: downloads}}}
+    packages = defaultdict(lambda: defaultdict(dict))
+    parse = CachedParse(cache, parse_package_downloads, "package-ip-counts")
+    bintray_package = "{}:{}".format(package, user)
+    for url in source.list_logs(subject, repo, bintray_package):
+        local_name = cache.get(subject, repo, bintray_package, url) if cache else None
+        if not local_name:
+            local_name = source.download_log(subject, repo, bintray_package, url)
+            if cache:
+                local_name = cache.put(subject, repo, bintray_package, url, local_name)
+        with span("parse", package=bintray_package, file=url) as timing:
+            log_packages, ip_counts = parse(local_name)
+            timing.add("rows", int(ip_counts.sum()))
+        date = packages[log_date(url).strftime("%Y-%m-%d")]
+        for version, package_ids in log_packages.items():
+            for package_id, count in package_ids.items():
+                date[version][package_id] = date[version].get(package_id, 0) + count
+        ip_counts = encode_counts('ip_address', ip_counts)
+        checkpoint.add_ip_counts(ip_counts)
+        checkpoint.sketches.add(bintray_package, log_date(url), ip_counts)
 
     return packages
 
 
-def get_package_owner_repo(reference):
+def get_package_owner_repo(reference, owners=None):
     username = os.getenv("BINTRAY_USERNAME")
     apikey = os.getenv("BINTRAY_API_KEY")
     if not username or not apikey:
         raise Exception("Login failed! BINTRAY_USERNAME and BINTRAY_API_KEY must be configured!")
     auth = HTTPBasicAuth(username, apikey)
     conan_ref = ConanFileReference.loads(reference)
-    url = "https://api.bintray.com/packages/conan/conan-center/{}:{}".format(conan_ref.name, conan_ref.user)
+    package = "{}:{}".format(conan_ref.name, conan_ref.user)
+    if owners and owners.get(package):
+        return owners.get(package)
+    url = "{}/packages/conan/conan-center/{}".format(Bintray.BINTRAY_URL, package)
     # FIXME = HTTPBasicAuth doesn't work for Bintray
-    response = requests.get(url)
+    response = PooledRequester().request("GET", url, auth=None)
     if response.ok:
-        return response.json()
+        json_data = response.json()
+        if owners:
+            owners.put(package, json_data)
+        return json_data
     else:
         logging.error(response.text)
         return None
@@ -373,7 +256,7 @@ def get_ip_owner(ip_address):
         return "Unknown"
 
 
-def upload_file(file):
+def upload_files(files):
     remote = os.getenv("BINTRAY_REMOTE")
     username = os.getenv("BINTRAY_USERNAME")
     apikey = os.getenv("BINTRAY_API_KEY")
@@ -382,61 +265,93 @@ def upload_file(file):
         return
 
     subject, repo, package = remote.split('/')
-    bintray = Bintray()
     today = datetime.date.today()
     version = today.strftime("%Y%m%d")
-    basename = os.path.basename(file)
-    try:
-        logging.info("Uploading {}".format(basename))
-        bintray.upload_content(subject, repo, package, version, basename, file, override=True)
-        logging.info("Done!")
-    except Exception as error:
-        logging.error(str(error))
-
-
-def collect_ips(file):
-    data = pandas.read_csv(file)
-    return data.ip_address
+    pipeline = UploadPipeline(create_bintray(), subject, repo, package, version)
+    for file in files:
+        pipeline.add(file)
+    check_uploads(pipeline.run())
+    logging.info("Done!")
 
 
 if __name__ == "__main__":
-    browser = None
+    instrumentation.start("conan-statistics")
+    source = create_log_source()
+    cache = LogCache()
+    metadata = ConanMetadata()
+    owners = OwnerCache()
+    costs = PackageCosts()
+    journal = CheckpointJournal()
     try:
         logging.info("Retrieve all recipes from Conan center")
-        official_recipes = get_recipe_list_from_bintray()
+        with span("recipes"):
+            official_recipes = get_recipe_list_from_bintray(metadata)
         # {"protobuf": ["protobuf/1.3.6@bincrafers/stable", ...], ...}
         official_recipes = filter_recipe_list_by_name(official_recipes)
         logging.info("Recipes to be analyzed({}): {}".format(len(official_recipes.keys()), official_recipes.keys()))
-        # for each package name
-        for key, values in official_recipes.items():
+        # {name: owner/repo} of the packages already looked up
+        owner_repos = {}
+        if not WORK_QUEUE:
+            # the settings of the allowed packages of the whole page are searched in the background
+            # while the logs are downloaded
+            finished = set(journal.finished())
+            page = paginate_recipe_list(official_recipes)
+            with span("owners"):
+                for name in sorted(set(page) - finished):
+                    owner_repos[name] = get_package_owner_repo(page[name][0], owners)
+                    if owner_repos[name] and owner_repos[name]["owner"] in get_allowed_owners():
+                        metadata.prefetch(page[name])
+        # for each package name of this job
+        for key, values in iterate_recipes(official_recipes, costs):
+            checkpoint = journal.load(key)
+            if checkpoint:
+                logging.info("Package %s restored from checkpoint" % key)
+                merge_package_checkpoint(checkpoint)
+                print_statistics(key, checkpoint)
+                continue
+            started = time.time()
+            checkpoint = PackageCheckpoint(key)
             # First package reference
             conan_ref = ConanFileReference.loads(values[0])
             # Retrieve linked repo name which is pointed by Conan center
-            json_data = get_package_owner_repo(conan_ref.full_repr())
+            if key in owner_repos:
+                json_data = owner_repos[key]
+            else:
+                with span("owner", package=key):
+                    json_data = get_package_owner_repo(conan_ref.full_repr(), owners)
             if not json_data:
                 continue
             # We can't retrieve statistics from any user
             if json_data["owner"] not in get_allowed_owners():
                 continue
-            logging.info("Bintray Browser login")
-            browser = create_browser()
-            browser = login(browser)
+            metadata.prefetch(values)
             logging.info("Retrieve all logs for package %s" % key)
-            packages = get_package_logs(browser, json_data["owner"], json_data["repo"], conan_ref.name, conan_ref.user)
-            # package settings
-            settings = []
-            # For each package version
-            for reference in values:
-                # Get package id and settings
-                bintray_packages = get_package_info_from_bintray(reference)
-                # Intersection between downloaded packages and package settings
-                settings.extend(filter_package_info_by_version(packages, bintray_packages))
+            with span("package_logs", package=key):
+                packages = get_package_logs(source, checkpoint, json_data["owner"], json_data["repo"], conan_ref.name,
+                                            conan_ref.user, cache)
+            # Get package id and settings for each package version
+            with span("package_settings", package=key):
+                bintray_packages = get_package_info_from_bintray(metadata, values)
+            # Intersection between downloaded packages and package settings
+            with span("join", package=key) as timing:
+                settings = filter_package_info_by_version(packages, bintray_packages)
+                add_package_downloads(checkpoint, settings)
+                timing.add("package_ids", len(settings))
+            journal.save(checkpoint)
+            merge_package_checkpoint(checkpoint)
             # Print package statistics
-            print_statistics(key, settings)
-            browser.close()
+            print_statistics(key, checkpoint)
+            costs.record(key, time.time() - started, values)
         # Print TOTAL statistics
         print_total_statistics()
-        upload_total_statistics()
+        with span("total"):
+            upload_total_statistics()
+        release_recipes()
     finally:
-        if browser:
-            browser.quit()
+        cache.evict()
+        metadata.close()
+        metadata.save()
+        owners.save()
+        costs.save()
+        journal.close()
+        source.close()
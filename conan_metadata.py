@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from conans.client import conan_api
+
+
+METADATA_CACHE = os.getenv("CONAN_METADATA_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".conan-statistics", "metadata.json"))
+METADATA_TTL = int(os.getenv("CONAN_METADATA_TTL", 24 * 60 * 60))
+METADATA_WORKERS = int(os.getenv("CONAN_METADATA_WORKERS", 4))
+
+
+class ConanMetadata(object):
+    # Recipe and binary package metadata from a Conan remote.
+    # Searches run on one pool of METADATA_WORKERS threads kept for the whole run, each thread
+    # creates its Conan API instance once and reuses it; close() stops them. Search results
+    # are kept on disk by reference: entries pinned to a revision (name/version@user/channel#rev)
+    # never expire, the others are refreshed after METADATA_TTL seconds.
+
+    def __init__(self, remote="conan-center", cache_file=METADATA_CACHE, ttl=METADATA_TTL, workers=METADATA_WORKERS):
+        self.remote = remote
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.workers = workers
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+        # reference -> future of searches started but not collected yet
+        self._pending = {}
+        self._cache = {}
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file) as json_file:
+                    self._cache = json.load(json_file)
+            except ValueError as error:
+                logging.warning("Ignoring metadata cache {}: {}".format(cache_file, error))
+
+    def _api(self):
+        if not hasattr(self._local, "instance"):
+            self._local.instance, _, _ = conan_api.Conan.factory()
+        return self._local.instance
+
+    def _is_fresh(self, reference, entry):
+        return "#" in reference or time.time() - entry["fetched"] < self.ttl
+
+    def search_recipes(self, pattern="*"):
+        return self._api().search_recipes(pattern, remote_name=self.remote)
+
+    def _search_packages(self, reference):
+        packages = self._api().search_packages(reference, remote_name=self.remote)
+        items = packages["results"][0]["items"]
+        with self._lock:
+            self._cache[reference] = {"fetched": time.time(), "items": items}
+        return items
+
+    def _cached(self, reference):
+        entry = self._cache.get(reference)
+        return entry["items"] if entry and self._is_fresh(reference, entry) else None
+
+    def _submit(self, reference):
+        with self._lock:
+            future = self._pending.get(reference)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers)
+                future = self._pending[reference] = self._executor.submit(self._search_packages, reference)
+            return future
+
+    def prefetch(self, references):
+        # start searching in the background, search_packages then only waits for the results
+        for reference in references:
+            if self._cached(reference) is None:
+                self._submit(reference)
+
+    def search_packages(self, references):
+        # {reference: [{'recipe': {'id': ...}, 'packages': [...]}]}, only unknown references reach the remote
+        result = {}
+        futures = {}
+        for reference in references:
+            items = self._cached(reference)
+            if items is not None:
+                result[reference] = items
+            else:
+                futures[reference] = self._submit(reference)
+        for reference, future in futures.items():
+            try:
+                result[reference] = future.result()
+            except Exception as error:
+                logging.error("Could not search packages of {}: {}".format(reference, error))
+                result[reference] = []
+            with self._lock:
+                self._pending.pop(reference, None)
+        return result
+
+    def close(self):
+        # prefetched searches not started yet are dropped
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def save(self):
+        if not self.cache_file:
+            return
+        folder = os.path.dirname(self.cache_file)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        fd, temp_name = tempfile.mkstemp(dir=folder or None, suffix=".tmp")
+        with os.fdopen(fd, "w") as json_file:
+            with self._lock:
+                json.dump(self._cache, json_file)
+        os.replace(temp_name, self.cache_file)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import json
+import base64
+import numpy
+import pandas
+
+from interning import StringDictionary, MISSING
+from partial_statistics import Breakdown
+
+
+CUBE_DIMENSIONS = ['package', 'version', 'os', 'arch', 'compiler', 'compiler.version', 'build_type', 'date']
+CUBE_VERSION = 1
+
+
+def settings_coordinates(settings):
+    # installer packages only have os_build/arch_build
+    arch_key = "arch_build" if "arch_build" in settings else "arch"
+    os_key = "os_build" if "os_build" in settings else "os"
+    return {
+        'os': settings.get(os_key),
+        'arch': settings.get(arch_key),
+        'compiler': settings.get('compiler'),
+        'compiler.version': settings.get('compiler.version'),
+        'build_type': settings.get('build_type'),
+    }
+
+
+def compiler_label(compiler, version):
+    return "{} {}".format(compiler, version) if version is not None else compiler
+
+
+class DownloadCube(object):
+    # Sparse download counts over CUBE_DIMENSIONS. A cell is one row of int32 codes, one code
+    # per dimension (MISSING when the package has no such setting), plus its count. New cells,
+    # added or merged from other cubes, are buffered and summed into distinct rows once, when the
+    # cube is queried or saved, so merging many small cubes costs no more than merging them all at once.
+
+    def __init__(self):
+        self.dictionaries = {dimension: StringDictionary() for dimension in CUBE_DIMENSIONS}
+        self._codes = numpy.zeros((0, len(CUBE_DIMENSIONS)), dtype=numpy.int32)
+        self._counts = numpy.zeros(0, dtype=numpy.int64)
+        self._pending = []
+        self._pending_counts = []
+        # (codes, counts) blocks of merged cubes
+        self._pending_blocks = []
+
+    def _code(self, dimension, value):
+        return MISSING if value is None else self.dictionaries[dimension].code(str(value))
+
+    def add(self, coordinates, downloads):
+        # coordinates: {'package': 'zlib', 'os': 'Linux', ...}, missing dimensions are MISSING
+        self._pending.append([self._code(dimension, coordinates.get(dimension)) for dimension in CUBE_DIMENSIONS])
+        self._pending_counts.append(downloads)
+
+    def _append(self, codes, counts):
+        self._codes = numpy.concatenate([self._codes, codes])
+        self._counts = numpy.concatenate([self._counts, counts])
+        rows, inverse = numpy.unique(self._codes, axis=0, return_inverse=True)
+        sums = numpy.zeros(len(rows), dtype=numpy.int64)
+        numpy.add.at(sums, inverse.ravel(), self._counts)
+        self._codes, self._counts = rows.astype(numpy.int32), sums
+
+    def _compact(self):
+        blocks = self._pending_blocks
+        if self._pending:
+            blocks.append((numpy.array(self._pending, dtype=numpy.int32).reshape(-1, len(CUBE_DIMENSIONS)),
+                           numpy.array(self._pending_counts, dtype=numpy.int64)))
+        if blocks:
+            self._pending, self._pending_counts, self._pending_blocks = [], [], []
+            self._append(numpy.concatenate([codes for codes, _ in blocks]),
+                         numpy.concatenate([counts for _, counts in blocks]))
+
+    def __len__(self):
+        self._compact()
+        return len(self._counts)
+
+    def merge(self, other):
+        other._compact()
+        columns = []
+        for index, dimension in enumerate(CUBE_DIMENSIONS):
+            # the MISSING code (-1) of the other cube selects the sentinel at the end
+            lookup = numpy.array([self.dictionaries[dimension].code(value)
+                                  for value in other.dictionaries[dimension].values] + [MISSING], dtype=numpy.int32)
+            columns.append(lookup[other._codes[:, index]])
+        self._pending_blocks.append((numpy.stack(columns, axis=1).reshape(-1, len(CUBE_DIMENSIONS)), other._counts))
+
+    def _select(self, filters):
+        # filters: {dimension: value or [values]}, the cells matching every filter
+        self._compact()
+        mask = numpy.ones(len(self._counts), dtype=bool)
+        for dimension, values in (filters or {}).items():
+            if isinstance(values, str) or values is None:
+                values = [values]
+            dictionary = self.dictionaries[dimension]
+            codes = [MISSING if value is None else dictionary.codes.get(value) for value in values]
+            codes = [code for code in codes if code is not None]
+            mask &= numpy.isin(self._codes[:, CUBE_DIMENSIONS.index(dimension)], codes)
+        return self._codes[mask], self._counts[mask]
+
+    def total(self, filters=None):
+        _, counts = self._select(filters)
+        return int(counts.sum())
+
+    def _group(self, codes, counts, dimensions):
+        columns = codes[:, [CUBE_DIMENSIONS.index(dimension) for dimension in dimensions]]
+        rows, inverse = numpy.unique(columns.reshape(-1, len(dimensions)), axis=0, return_inverse=True)
+        sums = numpy.zeros(len(rows), dtype=numpy.int64)
+        numpy.add.at(sums, inverse.ravel(), counts)
+        return rows, sums
+
+    def rollup(self, dimensions, filters=None, dropna=True):
+        # downloads summed over every dimension not listed, highest counts first
+        codes, counts = self._select(filters)
+        if dropna:
+            keep = (codes[:, [CUBE_DIMENSIONS.index(dimension) for dimension in dimensions]] != MISSING).all(axis=1)
+            codes, counts = codes[keep], counts[keep]
+        rows, sums = self._group(codes, counts, dimensions)
+        values = [self.dictionaries[dimension].decode(rows[:, index]) for index, dimension in enumerate(dimensions)]
+        if len(dimensions) == 1:
+            index = pandas.Index(values[0], name=dimensions[0])
+        else:
+            index = pandas.MultiIndex.from_arrays(values, names=dimensions)
+        return pandas.Series(sums, index=index, name='downloads').sort_values(ascending=False, kind='mergesort')
+
+    def compilers(self, filters=None):
+        # "gcc 7" labels, as printed by conan-statistics
+        codes, counts = self._select(filters)
+        keep = codes[:, CUBE_DIMENSIONS.index('compiler')] != MISSING
+        rows, sums = self._group(codes[keep], counts[keep], ['compiler', 'compiler.version'])
+        labels = [compiler_label(self.dictionaries['compiler'].decode_one(compiler),
+                                 self.dictionaries['compiler.version'].decode_one(version)) for compiler, version in rows]
+        return pandas.Series(sums, index=pandas.Index(labels, dtype=object, name='compiler'),
+                             name='downloads').sort_values(ascending=False, kind='mergesort')
+
+    def breakdown(self, filters=None):
+        # the arch, compiler and os tables of conan-statistics
+        breakdown = Breakdown(self.total(filters))
+        for dimension, counts in (('arch', self.rollup(['arch'], filters)),
+                                  ('compiler', self.compilers(filters)),
+                                  ('os', self.rollup(['os'], filters))):
+            for value, downloads in counts.items():
+                breakdown.add(dimension, value, int(downloads))
+        return breakdown
+
+    def downloads_table(self):
+        # the downloads.csv layout: one row per package, arch, compiler and os columns and the total,
+        # columns are every value found in the cube. All packages are grouped in one pass over the cells.
+        self._compact()
+        dimensions = ['package', 'arch', 'compiler', 'compiler.version', 'os']
+        rows, sums = self._group(self._codes, self._counts, dimensions)
+        cells = pandas.DataFrame(rows, columns=dimensions)
+        cells['downloads'] = sums
+        cells['label'] = [compiler_label(self.dictionaries['compiler'].decode_one(compiler),
+                                         self.dictionaries['compiler.version'].decode_one(version))
+                          if compiler != MISSING else None
+                          for compiler, version in zip(cells['compiler'], cells['compiler.version'])]
+        packages = numpy.arange(len(self.dictionaries['package'].values))
+        parts = []
+        for dimension, column in (('arch', 'arch'), ('compiler', 'label'), ('os', 'os')):
+            known = cells[cells[dimension] != MISSING]
+            part = known.groupby(['package', column])['downloads'].sum().unstack(fill_value=0)
+            if column != 'label':
+                part.columns = self.dictionaries[dimension].decode(part.columns.values)
+            parts.append(part[sorted(part.columns)])
+        parts.append(cells.groupby('package')['downloads'].sum().rename('Total'))
+        table = pandas.concat(parts, axis=1).reindex(packages)
+        table.index = pandas.Index([package.upper() for package in self.dictionaries['package'].values],
+                                   name='Packages')
+        return table.fillna(0).astype(numpy.int64)
+
+    def to_dict(self):
+        self._compact()
+        return {
+            "version": CUBE_VERSION,
+            "dimensions": CUBE_DIMENSIONS,
+            "values": {dimension: self.dictionaries[dimension].values for dimension in CUBE_DIMENSIONS},
+            "codes": base64.b64encode(self._codes.astype('<i4').tobytes()).decode(),
+            "counts": base64.b64encode(self._counts.astype('<i8').tobytes()).decode(),
+        }
+
+    @staticmethod
+    def from_dict(data):
+        if data.get("version") != CUBE_VERSION or data.get("dimensions") != CUBE_DIMENSIONS:
+            raise Exception("Unsupported download cube version: {}".format(data.get("version")))
+        cube = DownloadCube()
+        for dimension in CUBE_DIMENSIONS:
+            for value in data["values"][dimension]:
+                cube.dictionaries[dimension].code(value)
+        codes = numpy.frombuffer(base64.b64decode(data["codes"]), dtype='<i4').astype(numpy.int32)
+        cube._codes = codes.reshape(-1, len(CUBE_DIMENSIONS))
+        cube._counts = numpy.frombuffer(base64.b64decode(data["counts"]), dtype='<i8').astype(numpy.int64)
+        return cube
+
+    def save(self, file_name):
+        with open(file_name, 'w') as json_file:
+            json.dump(self.to_dict(), json_file)
+        return file_name
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name) as json_file:
+            return DownloadCube.from_dict(json.load(json_file))
+
+
+def merge_cube_files(file_names):
+    total = DownloadCube()
+    for file_name in file_names:
+        total.merge(DownloadCube.load(file_name))
+    return total
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import os
+import uuid
+from datetime import datetime
+import pandas
+import pyarrow
+import pyarrow.parquet as pq
+
+
+LOG_COLUMNS = ['ip_address', 'country', 'path_information']
+LOG_DTYPES = {'ip_address': 'category', 'country': 'category', 'path_information': str}
+CHUNK_SIZE = int(os.getenv("CONAN_LOG_CHUNK_SIZE", 100000))
+# /bincrafters/public-conan/bincrafters/protobuf/3.5.1/stable/0/package/8cf01e2f50fcd6b63525e70584df0326550364e1/0/conan_package.tgz
+# Paths which do not follow the layout only fill the file column (basename)
+PATH_INFORMATION_PATTERN = (r'^(?:/[^/]*/[^/]*/(?P<user>[^/]*)/(?P<name>[^/]*)/(?P<version>[^/]*)/(?P<channel>[^/]*)/'
+                            r'(?P<revision>[^/]*)/(?P<kind>export|package)/(?:(?P<package_id>[^/]*)/[^/]*/)?)?'
+                            r'.*?(?P<file>[^/]*)$')
+PATH_INFORMATION_COLUMNS = ['user', 'name', 'version', 'channel', 'revision', 'kind', 'package_id']
+# the events of a parsed log, as stored by the warehouse; package and date are the same for every row
+EVENT_COLUMNS = ['ip_address', 'country', 'provider', 'path_information'] + PATH_INFORMATION_COLUMNS
+EVENT_SCHEMA = pyarrow.schema([(column, pyarrow.string()) for column in EVENT_COLUMNS])
+# revisions and package ids are mostly distinct
+EVENT_DICTIONARY_COLUMNS = [column for column in EVENT_COLUMNS if column not in ('revision', 'package_id')]
+LOG_COUNT_COLUMNS = ['provider', 'country', 'ip_address']
+
+
+def log_date(file_name):
+    # downloads-26-06-2019.csv.gz
+    date = os.path.basename(file_name)[len("downloads-"):].split('.')[0]
+    return datetime.strptime(date, '%d-%m-%Y')
+
+
+def is_final_log(file_name):
+    # The log of the current day is still growing
+    return log_date(file_name).date() < datetime.utcnow().date()
+
+
+def read_download_log(file_name, usecols=None, chunksize=None):
+    # Decompress on the fly and yield fixed-size frames, so a log is never held in memory as a whole
+    usecols = usecols or LOG_COLUMNS
+    dtype = {column: LOG_DTYPES[column] for column in usecols}
+    reader = pandas.read_csv(file_name, usecols=usecols, dtype=dtype, compression='gzip',
+                             chunksize=chunksize or CHUNK_SIZE)
+    for chunk in reader:
+        yield chunk
+
+
+def split_path_information(pd_frame):
+    # Replace path_information by its basename and add one column per reference field
+    fields = pd_frame['path_information'].astype(str).str.extract(PATH_INFORMATION_PATTERN, expand=True)
+    pd_frame['path_information'] = fields['file']
+    for column in PATH_INFORMATION_COLUMNS:
+        pd_frame[column] = fields[column]
+    return pd_frame
+
+
+class ParsedLog(object):
+    # One package log reduced by the worker process that read it: downloads by provider, country
+    # and IP address, folded chunk by chunk, and its events, written chunk by chunk to a Parquet
+    # file with the warehouse layout. Neither the worker nor the caller holds the rows of the log.
+
+    def __init__(self, package, date, events_file=None):
+        self.package = package
+        self.date = date
+        self.events_file = events_file
+        self.rows = 0
+        # {column: downloads by value}, rows without a value are not counted
+        self.counts = dict((column, pandas.Series([], dtype='int64')) for column in LOG_COUNT_COLUMNS)
+
+    def add(self, pd_frame):
+        self.rows += len(pd_frame.index)
+        for column in LOG_COUNT_COLUMNS:
+            self.counts[column] = add_counts(self.counts[column], value_counts(pd_frame[column]))
+
+
+def events_file_name(file_name, providers):
+    # next to the log, so the events of a cached log live and are evicted with it
+    return "{}.events-{}.parquet".format(file_name, providers.digest)
+
+
+def write_events(writer, temp_name, pd_frame):
+    # plain strings, so every chunk has the same schema whatever its categories are
+    table = pyarrow.Table.from_pandas(pd_frame[EVENT_COLUMNS].astype(object), schema=EVENT_SCHEMA,
+                                      preserve_index=False)
+    if writer is None:
+        writer = pq.ParquetWriter(temp_name, EVENT_SCHEMA, use_dictionary=EVENT_DICTIONARY_COLUMNS,
+                                  compression='snappy')
+    writer.write_table(table)
+    return writer
+
+
+def parse_download_log(file_name, package, providers):
+    # Runs in a worker process: every argument and the result must be picklable
+    parsed = ParsedLog(package, log_date(file_name), events_file_name(file_name, providers))
+    temp_name = "{}.{}.tmp".format(parsed.events_file, uuid.uuid4().hex)
+    writer = None
+    try:
+        for pd_frame in read_download_log(file_name):
+            pd_frame.insert(0, 'provider', providers.lookup_column(pd_frame['ip_address']))
+            split_path_information(pd_frame)
+            parsed.add(pd_frame)
+            writer = write_events(writer, temp_name, pd_frame)
+        if writer is None:
+            parsed.events_file = None
+            return parsed
+        writer.close()
+        writer = None
+        # identical logs share a cached blob and may be parsed at the same time
+        os.replace(temp_name, parsed.events_file)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+    return parsed
+
+
+def parse_package_downloads(file_name):
+    # Single pass over a log: (version, package_id) download counts and downloads by IP address,
+    # both folded chunk by chunk. Only conan_package.tgz paths are split, the other rows just
+    # contribute their IP.
+    packages = {}
+    ip_counts = pandas.Series([], dtype='int64')
+    for pd_frame in read_download_log(file_name, usecols=['ip_address', 'path_information']):
+        ip_counts = add_counts(ip_counts, value_counts(pd_frame['ip_address']))
+        paths = pd_frame['path_information']
+        # /bincrafters/public-conan/bincrafters/protobuf/3.5.1/stable/0/package/8cf01e2f50fcd6b63525e70584df0326550364e1/0/conan_package.tgz
+        fields = paths[paths.str.endswith("/conan_package.tgz", na=False)].str.split('/', expand=True)
+        if fields.shape[1] < 12:
+            continue
+        fields = fields[fields[8] == "package"]
+        for (version, package_id), count in fields.groupby([5, 9]).size().items():
+            packages.setdefault(version, {})
+            packages[version][package_id] = packages[version].get(package_id, 0) + int(count)
+    return packages, ip_counts
+
+
+def value_counts(series):
+    # by value, without the categories a chunk does not use, so chunks with different ones add up
+    counts = series.value_counts(sort=False)
+    counts = counts[counts > 0]
+    return pandas.Series(counts.values, index=counts.index.astype(object), dtype='int64')
+
+
+def add_counts(total, counts):
+    if total is None:
+        return counts
+    return total.add(counts, fill_value=0).astype(int)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import atexit
+import cProfile
+import resource
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# JSON trace (Chrome trace event format) and Prometheus textfile, written only when set
+TRACE_FILE = os.getenv("CONAN_TRACE")
+METRICS_FILE = os.getenv("CONAN_METRICS")
+# comma separated span names profiled with cProfile, "all" for every span
+PROFILE_SPANS = set(name for name in os.getenv("CONAN_PROFILE", "").split(",") if name)
+PROFILE_FOLDER = os.getenv("CONAN_PROFILE_FOLDER", ".")
+METRICS_PREFIX = "conan_statistics"
+
+
+def rss_bytes():
+    # current resident set size, the peak where /proc is not available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Span(object):
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.values = {}
+
+    def add(self, metric, value):
+        # bytes, rows, ... attached to the span and summed into the counters
+        self.values[metric] = self.values.get(metric, 0) + value
+
+
+class Instrumentation(object):
+    # Spans (wall time, RSS and values like bytes or rows) and counters of one script run.
+    # Spans may be recorded from several threads; the trace keeps every span with its labels,
+    # the metrics sum them by span name.
+
+    def __init__(self, script):
+        self.script = script
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._events = []
+        self._span_seconds = defaultdict(float)
+        self._span_count = defaultdict(int)
+        self._counters = defaultdict(float)
+        self._profiles = {}
+        self._profiling = False
+
+    def _profiler(self, name):
+        if not PROFILE_SPANS or (name not in PROFILE_SPANS and "all" not in PROFILE_SPANS):
+            return None
+        with self._lock:
+            # cProfile can not profile nested spans or two threads at once
+            if self._profiling:
+                return None
+            self._profiling = True
+            return self._profiles.setdefault(name, cProfile.Profile())
+
+    @contextmanager
+    def span(self, name, **labels):
+        span = Span(name, labels)
+        profiler = self._profiler(name)
+        rss = rss_bytes()
+        started = time.time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield span
+        finally:
+            if profiler:
+                profiler.disable()
+                self._profiling = False
+            self.record(name, time.time() - started, started=started, rss=rss_bytes(), rss_delta=rss_bytes() - rss,
+                        values=span.values, **labels)
+
+    def record(self, name, seconds, started=None, rss=None, rss_delta=None, values=None, **labels):
+        # spans measured elsewhere, e.g. in a worker process, are recorded with their duration
+        started = started if started is not None else time.time() - seconds
+        args = dict(labels)
+        args.update(values or {})
+        if rss is not None:
+            args.update({"rss_bytes": rss, "rss_delta_bytes": rss_delta})
+        with self._lock:
+            self._events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.current_thread().ident,
+                                 "ts": int(started * 1e6), "dur": int(seconds * 1e6), "args": args})
+            self._span_seconds[name] += seconds
+            self._span_count[name] += 1
+            for metric, value in (values or {}).items():
+                self._counters[(metric, name)] += value
+
+    def count(self, metric, value=1, span=""):
+        with self._lock:
+            self._counters[(metric, span)] += value
+
+    def write_trace(self, file_name):
+        with self._lock:
+            events = list(self._events)
+        with open(file_name, "w") as json_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"script": self.script, "peak_rss_bytes": peak_rss_bytes()}}, json_file)
+        return file_name
+
+    def write_metrics(self, file_name):
+        # Prometheus textfile collector format, replaced atomically
+        script = 'script="{}"'.format(self.script)
+        lines = [
+            "# TYPE {}_span_seconds_total counter".format(METRICS_PREFIX),
+            "# TYPE {}_spans_total counter".format(METRICS_PREFIX),
+        ]
+        with self._lock:
+            for name in sorted(self._span_seconds):
+                labels = '{{{},span="{}"}}'.format(script, name)
+                lines.append("{}_span_seconds_total{} {:.6f}".format(METRICS_PREFIX, labels, self._span_seconds[name]))
+                lines.append("{}_spans_total{} {}".format(METRICS_PREFIX, labels, self._span_count[name]))
+            for metric in sorted(set(metric for metric, _ in self._counters)):
+                lines.append("# TYPE {}_{}_total counter".format(METRICS_PREFIX, metric))
+                for (name, span), value in sorted(self._counters.items()):
+                    if name == metric:
+                        lines.append('{}_{}_total{{{},span="{}"}} {}'.format(METRICS_PREFIX, metric, script, span,
+                                                                             value))
+        lines.append("# TYPE {}_peak_rss_bytes gauge".format(METRICS_PREFIX))
+        lines.append("{}_peak_rss_bytes{{{}}} {}".format(METRICS_PREFIX, script, peak_rss_bytes()))
+        lines.append("# TYPE {}_run_seconds gauge".format(METRICS_PREFIX))
+        lines.append("{}_run_seconds{{{}}} {:.3f}".format(METRICS_PREFIX, script, time.time() - self.started))
+        temp_name = file_name + ".tmp"
+        with open(temp_name, "w") as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n")
+        os.replace(temp_name, file_name)
+        return file_name
+
+    def write_profiles(self, folder):
+        for name, profiler in self._profiles.items():
+            profiler.dump_stats(os.path.join(folder, "profile-{}-{}.prof".format(self.script, name)))
+
+    def export(self):
+        if TRACE_FILE:
+            self.write_trace(TRACE_FILE)
+        if METRICS_FILE:
+            self.write_metrics(METRICS_FILE)
+        if self._profiles:
+            self.write_profiles(PROFILE_FOLDER)
+
+
+INSTRUMENTATION = None
+
+
+def start(script):
+    # one instrumentation per script, exported when the script exits
+    global INSTRUMENTATION
+    INSTRUMENTATION = Instrumentation(script)
+    atexit.register(INSTRUMENTATION.export)
+    return INSTRUMENTATION
+
+
+def span(name, **labels):
+    if INSTRUMENTATION is None:
+        return _no_span(name, labels)
+    return INSTRUMENTATION.span(name, **labels)
+
+
+@contextmanager
+def _no_span(name, labels):
+    yield Span(name, labels)
+
+
+def record(name, seconds, **labels):
+    if INSTRUMENTATION is not None:
+        INSTRUMENTATION.record(name, seconds, **labels)
+
+
+def count(metric, value=1, span=""):
+    if INSTRUMENTATION is not None:
+        INSTRUMENTATION.count(metric, value, span)
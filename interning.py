@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import numpy
+import pandas
+from ipaddress import IPv4Address, AddressValueError
+
+
+MISSING = -1
+# IPv4 addresses are stored as their own integer value, anything else (IPv6) is
+# interned and stored after the IPv4 space, so both fit in one int64 array
+IPV6_OFFSET = 1 << 32
+
+
+def factorize(series):
+    # codes and distinct values, reusing the categories when the column is already categorical
+    if str(series.dtype) == 'category':
+        return series.cat.codes.values, series.cat.categories
+    return pandas.factorize(series)
+
+
+def ipv4_to_int(ip_address):
+    try:
+        return int(IPv4Address(ip_address))
+    except (AddressValueError, ValueError):
+        return MISSING
+
+
+class StringDictionary(object):
+    # Shared value <-> integer code mapping, codes are stable for the whole run
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        if value not in self.codes:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+        return self.codes[value]
+
+    def _code_of_unique(self, value):
+        return self.code(value)
+
+    def encode(self, series):
+        # only the distinct values of the column go through the dictionary
+        codes, uniques = factorize(series)
+        lookup = numpy.array([self._code_of_unique(value) for value in uniques] + [MISSING], dtype=numpy.int64)
+        return lookup[codes]
+
+    def decode_one(self, code):
+        return self.values[code] if code != MISSING else None
+
+    def decode(self, codes):
+        return numpy.array([self.decode_one(code) for code in codes], dtype=object)
+
+
+class IPAddressDictionary(StringDictionary):
+
+    def _code_of_unique(self, value):
+        number = ipv4_to_int(value)
+        return number if number != MISSING else IPV6_OFFSET + self.code(value)
+
+    def decode_one(self, code):
+        if code == MISSING:
+            return None
+        if code < IPV6_OFFSET:
+            return str(IPv4Address(int(code)))
+        return self.values[code - IPV6_OFFSET]
+
+
+DICTIONARIES = {
+    'package': StringDictionary(),
+    'provider': StringDictionary(),
+    'country': StringDictionary(),
+    'ip_address': IPAddressDictionary(),
+}
+
+
+def encode(column, series):
+    return DICTIONARIES[column].encode(series) if column in DICTIONARIES else series.values
+
+
+def decode(column, values):
+    return DICTIONARIES[column].decode(values) if column in DICTIONARIES else values
+
+
+def encode_counts(column, counts):
+    # counts by value -> counts by code, values without a code are dropped
+    codes = encode(column, pandas.Series(counts.index.values, dtype=object))
+    counts = pandas.Series(counts.values, index=codes, dtype='int64')
+    counts = counts[counts.index != MISSING]
+    # values sharing a code are summed
+    return counts.groupby(level=0).sum() if not counts.index.is_unique else counts
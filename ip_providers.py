@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import heapq
+import hashlib
+import numpy
+import pandas
+from ipaddress import IPv4Network
+from interning import factorize, ipv4_to_int, MISSING
+
+
+class ProviderIndex(object):
+    # Sorted, non-overlapping IPv4 ranges labelled by provider. Each entry (single
+    # address or CIDR prefix) becomes an integer [start, end] range; overlaps are
+    # resolved by provider order, so the first provider listed wins.
+    UNKNOWN = "Unknown"
+
+    def __init__(self, providers):
+        self.names = list(providers.keys()) + [ProviderIndex.UNKNOWN]
+        ranges = []
+        for priority, ips in enumerate(providers.values()):
+            for ip in ips:
+                try:
+                    network = IPv4Network(ip, strict=False)
+                except ValueError:
+                    continue
+                ranges.append((int(network.network_address), int(network.broadcast_address), priority))
+        starts, ends, labels = ProviderIndex._merge(ranges)
+        self.starts = numpy.array(starts, dtype=numpy.int64)
+        self.ends = numpy.array(ends, dtype=numpy.int64)
+        self.labels = numpy.array(labels, dtype=numpy.int32)
+        # identifies the ranges, so results labelled with an older index can be told apart
+        self.digest = hashlib.sha1(self.starts.tobytes() + self.ends.tobytes() + self.labels.tobytes() +
+                                   ",".join(self.names).encode()).hexdigest()[:12]
+
+    @staticmethod
+    def _merge(ranges):
+        # sweep over range boundaries, keeping the active ranges in a heap
+        # ordered by priority; every elementary segment gets the best label
+        boundaries = sorted(set([start for start, _, _ in ranges] + [end + 1 for _, end, _ in ranges]))
+        ranges = sorted(ranges)
+        active = []
+        next_range = 0
+        starts, ends, labels = [], [], []
+        for index, point in enumerate(boundaries[:-1]):
+            while next_range < len(ranges) and ranges[next_range][0] <= point:
+                start, end, priority = ranges[next_range]
+                heapq.heappush(active, (priority, end))
+                next_range += 1
+            while active and active[0][1] < point:
+                heapq.heappop(active)
+            if not active:
+                continue
+            label = active[0][0]
+            end = boundaries[index + 1] - 1
+            if labels and labels[-1] == label and ends[-1] + 1 == point:
+                ends[-1] = end
+            else:
+                starts.append(point)
+                ends.append(end)
+                labels.append(label)
+        return starts, ends, labels
+
+    def lookup(self, ip_address):
+        return self.names[self.lookup_codes([ipv4_to_int(ip_address)])[0]]
+
+    def lookup_codes(self, values):
+        # values are integer addresses, anything outside the IPv4 space is Unknown
+        values = numpy.asarray(values, dtype=numpy.int64)
+        index = numpy.searchsorted(self.starts, values, side='right') - 1
+        found = (values >= 0) & (index >= 0)
+        found[found] = values[found] <= self.ends[index[found]]
+        labels = numpy.full(len(values), len(self.names) - 1, dtype=numpy.int32)
+        labels[found] = self.labels[index[found]]
+        return labels
+
+    def lookup_ints(self, values):
+        return numpy.array(self.names, dtype=object)[self.lookup_codes(values)]
+
+    def lookup_column(self, ip_addresses):
+        # every distinct address is converted only once
+        codes, uniques = factorize(ip_addresses)
+        labels = self.lookup_codes([ipv4_to_int(ip) for ip in uniques] + [MISSING])
+        return pandas.Categorical.from_codes(labels[codes], self.names)
+
+
+def read_providers(providers_file="providers.json", amazon_file="amazon_ip_range.json"):
+    with open(providers_file) as json_file:
+        providers = json.load(json_file)
+    if os.path.exists(amazon_file):
+        with open(amazon_file) as json_file:
+            amazon = json.load(json_file)
+        providers.setdefault("Amazon", []).extend([prefix["ip_prefix"] for prefix in amazon["prefixes"]])
+    return ProviderIndex(providers)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import pickle
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from download_logs import is_final_log
+
+
+CACHE_FOLDER = os.getenv("CONAN_LOG_CACHE", os.path.join(os.path.expanduser("~"), ".conan-statistics", "cache"))
+CACHE_SIZE = int(os.getenv("CONAN_LOG_CACHE_SIZE", 10 * 1024 * 1024 * 1024))
+
+
+def _atomic_write(path, write):
+    folder = os.path.dirname(path)
+    # fetch threads and parse processes write to the cache at the same time
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            write(temp_file)
+        os.replace(temp_name, path)
+    except:
+        os.remove(temp_name)
+        raise
+
+
+def _sha256(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class LogCache(object):
+    # Persistent store of daily download logs.
+    # keys/<organization>/<repo>/<package>/<log> holds the sha256 of the log content, which is
+    # stored once in blobs/<sha256>/<log>. Parsed results live next to their blob and share its lifetime.
+    # Blob mtime is refreshed on every hit, so eviction drops the least recently used logs.
+
+    def __init__(self, folder=CACHE_FOLDER, max_size=CACHE_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+
+    def _key_path(self, organization, repo, package, file):
+        return os.path.join(self.folder, "keys", organization, repo, package, file)
+
+    def _blob_path(self, digest, file):
+        # the log name is kept, since the log date is read from it
+        return os.path.join(self.folder, "blobs", digest[:2], digest, os.path.basename(file))
+
+    def is_blob(self, file_name):
+        return os.path.abspath(file_name).startswith(os.path.abspath(os.path.join(self.folder, "blobs")))
+
+    def get(self, organization, repo, package, file):
+        key_path = self._key_path(organization, repo, package, file)
+        if not os.path.exists(key_path):
+            return None
+        with open(key_path) as key_file:
+            blob_path = self._blob_path(key_file.read().strip(), file)
+        if not os.path.exists(blob_path):
+            return None
+        os.utime(blob_path, None)
+        return blob_path
+
+    def put(self, organization, repo, package, file, local_name):
+        if not is_final_log(file):
+            return local_name
+        digest = _sha256(local_name)
+        blob_path = self._blob_path(digest, file)
+        if not os.path.exists(blob_path):
+            with open(local_name, "rb") as local_file:
+                _atomic_write(blob_path, lambda blob_file: shutil.copyfileobj(local_file, blob_file))
+        _atomic_write(self._key_path(organization, repo, package, file), lambda key_file: key_file.write(digest.encode()))
+        return blob_path
+
+    def load_parsed(self, blob_path, kind):
+        parsed_path = "{}.{}.pickle".format(blob_path, kind)
+        if not os.path.exists(parsed_path):
+            return None
+        try:
+            with open(parsed_path, "rb") as parsed_file:
+                return pickle.load(parsed_file)
+        except Exception as error:
+            logging.warning("Could not load {}: {}".format(parsed_path, error))
+            return None
+
+    def store_parsed(self, blob_path, kind, result):
+        parsed_path = "{}.{}.pickle".format(blob_path, kind)
+        _atomic_write(parsed_path, lambda parsed_file: pickle.dump(result, parsed_file, pickle.HIGHEST_PROTOCOL))
+
+    def evict(self):
+        entries = []
+        total = 0
+        for blob_path in glob.glob(os.path.join(self.folder, "blobs", "*", "*", "*.csv.gz")):
+            # with its parsed results and parsed events
+            files = [blob_path] + glob.glob(blob_path + ".*.pickle") + glob.glob(blob_path + ".events-*.parquet")
+            size = sum(os.path.getsize(file) for file in files)
+            entries.append((os.path.getmtime(blob_path), size, files))
+            total += size
+        for _, size, files in sorted(entries):
+            if total <= self.max_size:
+                break
+            for file in files:
+                os.remove(file)
+            total -= size
+        # keys of evicted blobs are misses on the next lookup and get overwritten on download
+
+
+class CachedParse(object):
+    # Picklable wrapper which reuses the parsed result of a cached log
+
+    def __init__(self, cache, parse, kind):
+        self.cache = cache
+        self.parse = parse
+        self.kind = kind
+
+    def __call__(self, file_name, *args):
+        if self.cache is None or not self.cache.is_blob(file_name):
+            return self.parse(file_name, *args)
+        # identical logs share a blob, so the arguments are part of the parsed result name
+        kind = "{}-{}".format(self.kind, hashlib.sha1(repr(args).encode()).hexdigest()[:12])
+        result = self.cache.load_parsed(file_name, kind)
+        if result is None:
+            result = self.parse(file_name, *args)
+            self.cache.store_parsed(file_name, kind, result)
+        return result
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+from instrumentation import span, record, count
+
+
+FETCH_WORKERS = int(os.getenv("CONAN_FETCH_WORKERS", 8))
+PARSE_WORKERS = int(os.getenv("CONAN_PARSE_WORKERS", 0)) or None
+HOST_CONCURRENCY = int(os.getenv("CONAN_HOST_CONCURRENCY", 4))
+
+
+class HostLimiter(object):
+    # One bounded semaphore per host, shared by every fetch worker
+
+    def __init__(self, concurrency=HOST_CONCURRENCY):
+        self._concurrency = concurrency
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def __call__(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self._concurrency)
+            return self._semaphores[host]
+
+
+class LogFetcher(object):
+
+    def __init__(self, bintray, folder, limiter=None, cache=None):
+        self._bintray = bintray
+        self._folder = folder
+        self._limiter = limiter or HostLimiter()
+        self._cache = cache
+
+    def _request(self, func, *args):
+        with self._limiter(self._bintray.BINTRAY_URL):
+            return func(*args)
+
+    def list_logs(self, organization, repo, package):
+        with span("list_logs", package=package):
+            response = self._request(self._bintray.get_list_package_download_log_files, organization, repo, package)
+        return [log["name"] for log in response if "name" in log and "csv.gz" in log["name"]]
+
+    def download_log(self, organization, repo, package, file):
+        if self._cache:
+            cached = self._cache.get(organization, repo, package, file)
+            if cached:
+                count("cache_hits", span="download_log")
+                return cached
+        folder = os.path.join(self._folder, organization, package)
+        # the logs of a package are downloaded by several threads at once
+        os.makedirs(folder, exist_ok=True)
+        local_name = os.path.join(folder, file)
+        with span("download_log", package=package, file=file) as timing:
+            self._request(self._bintray.download_package_download_log_file, organization, repo, package, file,
+                          local_name)
+            timing.add("bytes", os.path.getsize(local_name))
+        if self._cache:
+            return self._cache.put(organization, repo, package, file, local_name)
+        return local_name
+
+
+def timed_call(func, *args):
+    # runs in a worker process, the duration is recorded by the caller
+    started = time.time()
+    result = func(*args)
+    return time.time() - started, result
+
+
+def fetch_package_logs(fetcher, targets, parse, consume, finish, fetch_workers=None, parse_workers=None):
+    # targets: [(organization, repo, package)]
+    # Listing and downloading run on a thread pool, parse(local_name, package) on a process pool.
+    # consume(target, result) and finish(target) are always called from the calling thread.
+    pending = {}
+    remaining = {}
+
+    def done(target):
+        remaining[target] -= 1
+        if not remaining[target]:
+            del remaining[target]
+            finish(target)
+
+    with ThreadPoolExecutor(fetch_workers or FETCH_WORKERS) as threads, \
+            ProcessPoolExecutor(parse_workers or PARSE_WORKERS) as processes:
+        for target in targets:
+            pending[threads.submit(fetcher.list_logs, *target)] = ("list", target)
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, target = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as error:
+                    logging.error("Could not {} logs of {}: {}".format(stage, target[2], error))
+                    if stage == "list":
+                        continue
+                    done(target)
+                    continue
+
+                if stage == "list":
+                    if not result:
+                        continue
+                    remaining[target] = len(result)
+                    for file in result:
+                        pending[threads.submit(fetcher.download_log, *(target + (file,)))] = ("download", target)
+                elif stage == "download":
+                    pending[processes.submit(timed_call, parse, result, target[2])] = ("parse", target)
+                else:
+                    seconds, result = result
+                    record("parse", seconds, package=target[2])
+                    consume(target, result)
+                    done(target)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import time
+import logging
+import tempfile
+
+import magic
+from bs4 import BeautifulSoup
+from selenium import webdriver
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.common.by import By
+from selenium.webdriver.firefox.options import Options
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+from bintray_client import create_bintray
+from log_fetcher import LogFetcher
+from instrumentation import span
+
+
+# rest: Bintray REST API, falling back to the browser for packages it can not list
+# browser: headless Firefox only
+LOG_SOURCE = os.getenv("CONAN_LOG_SOURCE", "rest")
+BROWSER_FALLBACK = os.getenv("CONAN_BROWSER_FALLBACK", "1") == "1"
+BROWSER_FOLDER = "/tmp"
+
+
+def create_browser():
+    profile = webdriver.FirefoxProfile()
+    profile.set_preference('browser.download.folderList', 2)
+    profile.set_preference('browser.download.manager.showWhenStarting', False)
+    profile.set_preference('browser.download.dir', '/srv/download')
+    profile.set_preference("browser.download.manager.alertOnEXEOpen", False)
+    profile.set_preference("browser.download.manager.closeWhenDone", False)
+    profile.set_preference("browser.download.manager.focusWhenStarting", False)
+    profile.set_preference('browser.download.dir', BROWSER_FOLDER)
+    profile.set_preference('browser.helperApps.neverAsk.saveToDisk', 'application/octet-stream')
+    options = Options()
+    options.headless = True
+    browser = webdriver.Firefox(profile, options=options)
+    return browser
+
+
+def login(browser):
+    username = os.getenv("BINTRAY_USERNAME")
+    password = os.getenv("BINTRAY_PASSWORD")
+    if not username or not password:
+        raise Exception("Login failed! BINTRAY_USERNAME and BINTRAY_PASSWORD must be configured!")
+    login_url = "https://bintray.com/login?forwardedFrom=%2F"
+    retry_limit = 10
+    while True:
+        retry = 0
+        browser.get(login_url)
+        browser_title = browser.title
+        browser.find_element_by_id("username").send_keys(username)
+        browser.find_element_by_id("password").send_keys(password)
+        browser.find_element_by_class_name("btn").click()
+
+        while browser_title == browser.title:
+            time.sleep(1)
+            retry += 1
+            if retry == retry_limit:
+                break
+
+        if browser_title != browser.title:
+            break
+
+    return browser
+
+
+def download_file(browser, url):
+    while True:
+        url_path = os.path.join(BROWSER_FOLDER, url)
+        if os.path.exists(url_path):
+            os.remove(url_path)
+
+        while True:
+            try:
+                browser.find_element_by_link_text(url).click()
+                break
+            except NoSuchElementException:
+                browser.refresh()
+                WebDriverWait(browser, 60).until(EC.presence_of_element_located((By.LINK_TEXT, 'Download Logs'))).click()
+
+        # wait for download
+        while not os.path.exists(url_path):
+            time.sleep(1)
+        while os.path.exists(url_path + ".crdownload"):
+            time.sleep(1)
+        while os.path.exists(url_path + ".part"):
+            time.sleep(1)
+        if magic.from_file(url_path, mime=True) == 'application/gzip':
+            break
+
+
+class RestLogSource(LogFetcher):
+    # Download logs through the Bintray REST API. Setting BINTRAY_URL points it to
+    # any server answering /packages/<subject>/<repo>/<package>/logs, e.g. a local fixture.
+
+    def close(self):
+        pass
+
+
+class BrowserLogSource(object):
+    # Download logs by clicking through the Bintray statistics page. The browser is
+    # started and logged in once, on first use, and shared by every package.
+
+    def __init__(self):
+        self._browser = None
+
+    def _session(self, renew=False):
+        if renew:
+            self.close()
+        if self._browser is None:
+            logging.info("Bintray Browser login")
+            with span("login"):
+                self._browser = login(create_browser())
+        return self._browser
+
+    def _open_statistics(self, subject, repo, package):
+        url = "https://bintray.com/{}/{}/{}#statistics".format(subject, repo, package.replace(":", "%3A"))
+        try:
+            browser = self._session()
+            browser.get(url)
+            WebDriverWait(browser, 60).until(EC.presence_of_element_located((By.LINK_TEXT, 'Download Logs'))).click()
+        except TimeoutException:
+            # the session may have expired, log in again once
+            browser = self._session(renew=True)
+            browser.get(url)
+            WebDriverWait(browser, 60).until(EC.presence_of_element_located((By.LINK_TEXT, 'Download Logs'))).click()
+        return browser
+
+    def list_logs(self, subject, repo, package):
+        # remove temporary files
+        for gz_file in glob.glob(os.path.join(BROWSER_FOLDER, "*.csv.gz")):
+            os.remove(gz_file)
+        with span("list_logs", package=package):
+            browser = self._open_statistics(subject, repo, package)
+        soup = BeautifulSoup(browser.page_source, 'html.parser')
+        logs = []
+        for link in soup.find_all('a'):
+            # look for csv files on statistics page
+            if "href" in link.attrs and "csv.gz" in link.attrs['href']:
+                href = link.attrs['href']
+                # extract file name
+                logs.append(href[href.rfind('=') + 1:])
+        return logs
+
+    def download_log(self, subject, repo, package, file):
+        # the statistics page of the package is still open from list_logs
+        with span("download_log", package=package, file=file) as timing:
+            download_file(self._session(), file)
+            timing.add("bytes", os.path.getsize(os.path.join(BROWSER_FOLDER, file)))
+        return os.path.join(BROWSER_FOLDER, file)
+
+    def close(self):
+        if self._browser is not None:
+            self._browser.quit()
+            self._browser = None
+
+
+class FallbackLogSource(object):
+    # Try the primary source first, packages it can not list are read from the fallback
+
+    def __init__(self, primary, fallback):
+        self._primary = primary
+        self._fallback = fallback
+        self._sources = {}
+
+    def list_logs(self, subject, repo, package):
+        try:
+            logs = self._primary.list_logs(subject, repo, package)
+            self._sources[(subject, repo, package)] = self._primary
+        except Exception as error:
+            logging.warning("Could not list logs of {} through REST ({}), using the browser".format(package, error))
+            logs = self._fallback.list_logs(subject, repo, package)
+            self._sources[(subject, repo, package)] = self._fallback
+        return logs
+
+    def download_log(self, subject, repo, package, file):
+        source = self._sources.get((subject, repo, package), self._primary)
+        return source.download_log(subject, repo, package, file)
+
+    def close(self):
+        self._primary.close()
+        self._fallback.close()
+
+
+def create_log_source(kind=LOG_SOURCE, fallback=BROWSER_FALLBACK):
+    if kind == "browser":
+        return BrowserLogSource()
+    if kind != "rest":
+        raise Exception("Unknown log source '{}', expected 'rest' or 'browser'".format(kind))
+    source = RestLogSource(create_bintray(), tempfile.mkdtemp("logs", "conan"))
+    return FallbackLogSource(source, BrowserLogSource()) if fallback else source
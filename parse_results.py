@@ -1,60 +1,87 @@
 import argparse
 import csv
+import gzip
 import re
-import sys
 
+from partial_statistics import read_package_results
 
-def extract_projects(file):
-    projects = {}
-    log_file = open(args.file, 'r')
+
+# table title in the log -> dimension of the results, in column order
+GROUPS = [("Arch", "arch"), ("Compiler", "compiler"), ("OS", "os")]
+
+
+def open_text(file):
+    return gzip.open(file, 'rt') if file.endswith(".gz") else open(file, 'r')
+
+
+def extract_log_projects(file):
+    # (project, {dimension: {key: downloads}}, total) from the tables printed by conan-statistics.py
+    dimensions = dict(GROUPS)
     title_pattern = re.compile("===== (.*) =====")
+    header_pattern = re.compile(r"\| (\S.*?) +\| +Downloads \|")
     title = None
-    for line in log_file:
-        if title_pattern.match(line):
-            title = title_pattern.match(line).group(1)
-            if title == "TOTAL":
+    dimension = None
+    counts = {}
+    with open_text(file) as log_file:
+        for line in log_file:
+            if title_pattern.match(line):
+                title = title_pattern.match(line).group(1)
+                counts = {}
+                if title == "TOTAL":
+                    title = None
+            elif "Downloads" in line:
+                header = header_pattern.match(line)
+                dimension = dimensions.get(header.group(1)) if header else None
+            elif line.startswith("| ") and title and dimension:
+                line = line.split("|")
+                key = line[1].strip()
+                counts.setdefault(dimension, {})[key] = int(line[2])
+            elif line.startswith("TOTAL:") and title:
+                yield title, counts, int(line.split("TOTAL:")[1])
                 title = None
-                continue
-            elif title in projects:
-                raise Exception("{} is duplicated".format(title))
-            projects[title] = {}
-        elif "Downloads" in line:
-            continue
-        elif line.startswith("| ") and title:
-            line = line.split("|")
-            key = line[1].lstrip().rstrip()
-            value = int(line[2])
-            projects[title][key] = value
-        elif line.startswith("TOTAL:") and title:
-            line = line.split("TOTAL:")
-            value = int(line[1])
-            projects[title]["Total"] = value
-    return projects
+
+
+def extract_json_projects(file):
+    # the same from the results-*.jsonl stream of conan-statistics.py
+    with open_text(file) as json_file:
+        for name, breakdown in read_package_results(json_file):
+            yield name.upper(), {dimension: breakdown.counts(dimension) for _, dimension in GROUPS}, \
+                breakdown.downloads
+
+
+def extract_projects(file):
+    reader = extract_json_projects if ".jsonl" in file else extract_log_projects
+    projects = set()
+    for project, counts, total in reader(file):
+        if project in projects:
+            raise Exception("{} is duplicated".format(project))
+        projects.add(project)
+        yield project, counts, total
+
+
+def discover_columns(file):
+    # first pass: every key of every table, so no new compiler or arch is dropped
+    keys = {dimension: set() for _, dimension in GROUPS}
+    for _, counts, _ in extract_projects(file):
+        for dimension, values in counts.items():
+            keys[dimension].update(values)
+    return [(dimension, key) for _, dimension in GROUPS for key in sorted(keys[dimension])]
+
+
+def write_downloads(file, output="downloads.csv"):
+    # second pass: one row per project, only the current project is kept in memory
+    columns = discover_columns(file)
+    with open(output, 'w') as csv_file:
+        writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(["Packages"] + [key for _, key in columns] + ["Total"])
+        for project, counts, total in extract_projects(file):
+            writer.writerow([project] + [counts.get(dimension, {}).get(key, 0) for dimension, key in columns] + [total])
+    return output
 
 
 if __name__ == "__main__":
-    argparse = argparse.ArgumentParser()
-    argparse.add_argument("file")
-    args = argparse.parse_args()
-
-    expected_keys = ["Packages","x86_64", "x86", "armv7", "armv7hf", "Visual Studio 12", "Visual Studio 14",
-                     "Visual Studio 15", "Visual Studio 16", "apple-clang 10.0", "apple-clang 7.3",
-                     "apple-clang 8.0", "apple-clang 8.1", "apple-clang 9.0", "apple-clang 9.1",
-                     "clang 3.9", "clang 4.0", "clang 5.0", "clang 6.0", "clang 7.0", "clang 8",
-                     "gcc 4.6", "gcc 4.8", "gcc 4.9", "gcc 5", "gcc 6", "gcc 6.3", "gcc 7",
-                     "gcc 7.1", "gcc 8", "gcc 9", "Linux", "Macos", "Windows", "Total"]
-
-    csv_file = open("downloads.csv", 'w')
-    writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-    writer.writerow(expected_keys)
-    expected_keys.pop(0)
-
-    projects = extract_projects(args.file)
-    for project, attributes in projects.items():
-        row = [project]
-        for expected_key in expected_keys:
-            if expected_key not in attributes:
-                row.append(0)
-            else:
-                row.append(attributes[expected_key])
-        writer.writerow(row)
+    parser = argparse.ArgumentParser(description="Export conan-statistics.py results (log or .jsonl) as CSV")
+    parser.add_argument("file")
+    parser.add_argument("--output", default="downloads.csv")
+    args = parser.parse_args()
+    write_downloads(args.file, args.output)
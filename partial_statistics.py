@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+from collections import defaultdict
+
+
+PARTIAL_SCHEMA = "conan-statistics/partial"
+PARTIAL_VERSION = 1
+DIMENSIONS = ["arch", "compiler", "os", "ip_owner"]
+# positions of the dimensions in the list written before the schema existed
+LEGACY_DIMENSIONS = ["arch", "compiler", "os", "ip_owner"]
+
+
+class Breakdown(object):
+    # Downloads and their count by value of each dimension, {"arch": {"x86_64": 10, ...}, ...}
+
+    def __init__(self, downloads=0, dimensions=None):
+        self.downloads = downloads
+        self.dimensions = defaultdict(lambda: defaultdict(int))
+        for dimension, counts in (dimensions or {}).items():
+            self.dimensions[dimension].update(counts)
+
+    def add(self, dimension, value, downloads):
+        if dimension not in DIMENSIONS:
+            raise Exception("Unknown dimension '{}', expected one of {}".format(dimension, DIMENSIONS))
+        self.dimensions[dimension][value] += downloads
+
+    def merge(self, other):
+        self.downloads += other.downloads
+        for dimension, counts in other.dimensions.items():
+            target = self.dimensions[dimension]
+            for value, downloads in counts.items():
+                target[value] += downloads
+
+    def counts(self, dimension):
+        return dict(self.dimensions.get(dimension, {}))
+
+    def to_dict(self):
+        return {
+            "downloads": self.downloads,
+            "dimensions": {dimension: dict(counts) for dimension, counts in sorted(self.dimensions.items())},
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return Breakdown(data["downloads"], data["dimensions"])
+
+
+class PartialStatistics(object):
+    # Download statistics of one or more shards. Merging sums the counts and unions the
+    # shard names in sources, so partial results can be merged in any grouping and order.
+    # A partial whose sources were all merged already is skipped, re-running a merge over
+    # the same files does not count them twice.
+
+    def __init__(self, sources=None):
+        self.sources = set(sources or [])
+        self.total = Breakdown()
+        self.packages = {}
+
+    def package(self, name):
+        if name not in self.packages:
+            self.packages[name] = Breakdown()
+        return self.packages[name]
+
+    def add_package(self, name, breakdown):
+        self.package(name).merge(breakdown)
+        self.total.merge(breakdown)
+
+    def merge(self, other):
+        if other.sources and other.sources <= self.sources:
+            return False
+        if self.sources & other.sources:
+            raise Exception("Can not merge partial statistics sharing only some sources: {}".format(
+                sorted(self.sources & other.sources)))
+        self.sources |= other.sources
+        self.total.merge(other.total)
+        for name, breakdown in other.packages.items():
+            self.package(name).merge(breakdown)
+        return True
+
+    def to_dict(self):
+        return {
+            "schema": PARTIAL_SCHEMA,
+            "version": PARTIAL_VERSION,
+            "dimensions": DIMENSIONS,
+            "sources": sorted(self.sources),
+            "total": self.total.to_dict(),
+            "packages": {name: breakdown.to_dict() for name, breakdown in sorted(self.packages.items())},
+        }
+
+    @staticmethod
+    def from_dict(data, source=None):
+        if isinstance(data, list):
+            return PartialStatistics.from_legacy(data, source)
+        if data.get("schema") != PARTIAL_SCHEMA or data.get("version") != PARTIAL_VERSION:
+            raise Exception("Unsupported partial statistics: {} version {}".format(data.get("schema"),
+                                                                                  data.get("version")))
+        partial = PartialStatistics(data["sources"])
+        partial.total = Breakdown.from_dict(data["total"])
+        partial.packages = {name: Breakdown.from_dict(value) for name, value in data["packages"].items()}
+        return partial
+
+    @staticmethod
+    def from_legacy(data, source=None):
+        # [arch, compiler, os, ip_owner, {"total": downloads}], without per package counts
+        partial = PartialStatistics([source] if source else None)
+        for dimension, counts in zip(LEGACY_DIMENSIONS, data):
+            for value, downloads in counts.items():
+                partial.total.add(dimension, value, downloads)
+        partial.total.downloads = data[len(LEGACY_DIMENSIONS)]["total"]
+        return partial
+
+    def save(self, file_name):
+        with open(file_name, 'w') as json_file:
+            json.dump(self.to_dict(), json_file)
+        return file_name
+
+    @staticmethod
+    def load(file_name, source=None):
+        with open(file_name) as json_file:
+            return PartialStatistics.from_dict(json.load(json_file), source or os.path.basename(file_name))
+
+
+class PackageResults(object):
+    # One JSON line per finished package, written as the run goes:
+    # {"package": "zlib", "downloads": 10, "dimensions": {"arch": {...}, ...}}
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = None
+
+    def write(self, name, breakdown):
+        if self._file is None:
+            self._file = open(self.file_name, 'w')
+        record = {"package": name}
+        record.update(breakdown.to_dict())
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            self._file = open(self.file_name, 'w')
+        self._file.close()
+        return self.file_name
+
+
+def read_package_results(json_file):
+    # (name, Breakdown) of each line, one line in memory at a time
+    for line in json_file:
+        if line.strip():
+            record = json.loads(line)
+            yield record["package"], Breakdown.from_dict(record)
+
+
+def merge_partial_files(file_names):
+    # one pass over the shard files, each one is folded into the total and dropped
+    total = PartialStatistics()
+    for file_name in file_names:
+        total.merge(PartialStatistics.load(file_name))
+    return total
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import argparse
+from urllib.request import pathname2url
+from datetime import datetime, timedelta
+import pandas
+
+
+ROLLUPS_FILE = os.getenv("CONAN_ROLLUPS", os.path.join(os.path.expanduser("~"), ".conan-statistics", "rollups.sqlite"))
+LEVELS = ["day", "week", "month"]
+# downloads without a known country
+UNKNOWN_COUNTRY = ""
+
+
+def period_start(date, level):
+    # weeks start on Monday, months on their first day
+    if level == "day":
+        return date
+    if level == "week":
+        return date - timedelta(days=date.weekday())
+    if level == "month":
+        return date.replace(day=1)
+    raise Exception("Unknown rollup level '{}', expected one of {}".format(level, ", ".join(LEVELS)))
+
+
+def country_counts(pd_frames):
+    countries = pandas.concat([pd_frame['country'].astype(object) for pd_frame in pd_frames], ignore_index=True)
+    return countries.where(countries.notna(), UNKNOWN_COUNTRY).value_counts(sort=False)
+
+
+class Rollups(object):
+    # Downloads by package, country and day, week and month in SQLite. Like the warehouse, only
+    # finished days are added, each one once: the days already rolled up are kept in their own
+    # table and adding them again is a no-op, so every level stays exact as new days arrive.
+
+    def __init__(self, file_name=ROLLUPS_FILE, read_only=False):
+        if read_only:
+            # readers never write, not even the schema, so they never wait for the writer's lock
+            self._connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(os.path.abspath(file_name))),
+                                               uri=True, timeout=60)
+            return
+        folder = os.path.dirname(file_name)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self._connection = sqlite3.connect(file_name, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS days (package TEXT, date TEXT, "
+                                     "PRIMARY KEY (package, date))")
+            # range queries of one package and level read a contiguous slice of the primary key
+            self._connection.execute("CREATE TABLE IF NOT EXISTS downloads (package TEXT, level TEXT, period TEXT, "
+                                     "country TEXT, downloads INTEGER, "
+                                     "PRIMARY KEY (package, level, period, country)) WITHOUT ROWID")
+
+    def has_day(self, package, date):
+        return self._connection.execute("SELECT 1 FROM days WHERE package = ? AND date = ?",
+                                        (package, date.strftime("%Y-%m-%d"))).fetchone() is not None
+
+    def add_day(self, package, date, countries):
+        # countries: downloads of the day by country
+        # the current day is still growing, it is added once complete
+        if date.date() >= datetime.utcnow().date() or self.has_day(package, date):
+            return False
+        cells = []
+        for level in LEVELS:
+            period = period_start(date, level).strftime("%Y-%m-%d")
+            cells.extend((package, level, period, country, int(downloads)) for country, downloads in countries.items())
+        with self._connection:
+            self._connection.execute("INSERT INTO days VALUES (?, ?)", (package, date.strftime("%Y-%m-%d")))
+            # no UPSERT, it needs SQLite 3.24 and older distributions ship 3.22
+            self._connection.executemany("INSERT OR IGNORE INTO downloads VALUES (?, ?, ?, ?, 0)",
+                                         [cell[:4] for cell in cells])
+            self._connection.executemany("UPDATE downloads SET downloads = downloads + ? WHERE package = ? AND "
+                                         "level = ? AND period = ? AND country = ?",
+                                         [cell[4:] + cell[:4] for cell in cells])
+        return True
+
+    def add_log(self, parsed):
+        # a log reduced by download_logs.ParsedLog, its rows without a country are counted as unknown
+        countries = parsed.counts['country']
+        unknown = parsed.rows - int(countries.sum())
+        if unknown:
+            countries = pandas.concat([countries, pandas.Series([unknown], index=[UNKNOWN_COUNTRY])])
+        return self.add_day(parsed.package, parsed.date, countries)
+
+    def backfill(self, warehouse):
+        # roll up the warehouse days written before the rollups existed, or by other machines
+        added = 0
+        for package, date in warehouse.partitions():
+            if not self.has_day(package, date):
+                pd_frame = warehouse.read(columns=['country'], packages=[package], start=date, end=date)
+                added += self.add_day(package, date, country_counts([pd_frame]))
+        return added
+
+    def query(self, package, level="day", start=None, end=None, by_country=False):
+        # downloads of every period overlapping start..end, by country as columns if asked
+        sql = "SELECT period, country, downloads FROM downloads WHERE package = ? AND level = ?"
+        parameters = [package, level]
+        if start:
+            sql += " AND period >= ?"
+            parameters.append(period_start(start, level).strftime("%Y-%m-%d"))
+        if end:
+            sql += " AND period <= ?"
+            parameters.append(end.strftime("%Y-%m-%d"))
+        pd_frame = pandas.DataFrame(self._connection.execute(sql, parameters).fetchall(),
+                                    columns=['period', 'country', 'downloads'])
+        pd_frame['period'] = pandas.to_datetime(pd_frame['period'])
+        if by_country:
+            return pd_frame.pivot_table(index='period', columns='country', values='downloads', aggfunc='sum',
+                                        fill_value=0)
+        return pd_frame.groupby('period')['downloads'].sum()
+
+    def packages(self):
+        return [row[0] for row in self._connection.execute("SELECT DISTINCT package FROM days ORDER BY package")]
+
+    def close(self):
+        self._connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Downloads of a package over time, from the rollups")
+    parser.add_argument("package", help="e.g. zlib:conan")
+    parser.add_argument("--level", choices=LEVELS, default="week")
+    parser.add_argument("--days", type=int, default=90, help="periods of the last days (default 90)")
+    parser.add_argument("--countries", action="store_true", help="one column per country")
+    parser.add_argument("--file", default=ROLLUPS_FILE)
+    args = parser.parse_args()
+    rollups = Rollups(args.file, read_only=True)
+    start = datetime.utcnow() - timedelta(days=args.days)
+    print(rollups.query(args.package, args.level, start=start, by_country=args.countries).to_string())
+    rollups.close()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import heapq
+import fcntl
+import logging
+import tempfile
+import datetime
+
+
+TOTAL_PAGES = int(os.getenv("CONAN_TOTAL_PAGES", 0))
+CURRENT_PAGE = int(os.getenv("CONAN_CURRENT_PAGE", 0))
+# count: same number of packages per page, cost: same expected run time per page
+SHARD_MODE = os.getenv("CONAN_SHARD_MODE", "count")
+# seconds measured on each package, updated at the end of every run
+COSTS_FILE = os.getenv("CONAN_COSTS", os.path.join(os.path.expanduser("~"), ".conan-statistics", "costs.json"))
+# cost pages are computed from this snapshot only: every page of a run must read the same one, and
+# no worker ever writes it
+SHARD_COSTS = os.getenv("CONAN_SHARD_COSTS")
+WORK_QUEUE = os.getenv("CONAN_WORK_QUEUE")
+
+
+def _save_json(file_name, data):
+    folder = os.path.dirname(file_name)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    fd, temp_name = tempfile.mkstemp(dir=folder or None, suffix=".tmp")
+    with os.fdopen(fd, "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_name, file_name)
+
+
+class PackageCosts(object):
+    # Seconds spent on each package in previous runs, {"<name>": {"seconds": s, "references": n}}.
+    # Packages never measured are estimated from their number of references.
+
+    def __init__(self, file_name=COSTS_FILE):
+        self.file_name = file_name
+        self._costs = self._load()
+        self._recorded = {}
+
+    def _load(self):
+        if not self.file_name or not os.path.exists(self.file_name):
+            return {}
+        try:
+            with open(self.file_name) as json_file:
+                return json.load(json_file)
+        except ValueError as error:
+            logging.warning("Ignoring package costs {}: {}".format(self.file_name, error))
+            return {}
+
+    def _seconds_per_reference(self):
+        seconds = sum(cost["seconds"] for cost in self._costs.values())
+        references = sum(cost["references"] for cost in self._costs.values())
+        return seconds / references if seconds and references else 1.0
+
+    def cost(self, name, references):
+        if name in self._costs:
+            return float(self._costs[name]["seconds"])
+        return len(references) * self._seconds_per_reference()
+
+    def record(self, name, seconds, references):
+        # the pages of this run keep using the costs read at start
+        self._recorded[name] = {"seconds": round(seconds, 3), "references": len(references)}
+
+    def save(self):
+        # other workers may have saved their packages meanwhile, only ours are replaced
+        if self.file_name and self.file_name != SHARD_COSTS:
+            costs = self._load()
+            costs.update(self._recorded)
+            _save_json(self.file_name, costs)
+
+
+def count_shards(names, total_pages):
+    # contiguous slices of the sorted names, each with the same number of packages
+    names = sorted(names)
+    avg = len(names) / float(total_pages)
+    return [names[int(page * avg):int((page + 1) * avg)] for page in range(total_pages)]
+
+
+def cost_shards(costs, total_pages):
+    # Longest processing time first: the most expensive package goes to the cheapest page.
+    # Ties are broken by name, so every job computes the same pages from the same costs.
+    heap = [(0.0, page) for page in range(total_pages)]
+    shards = [[] for _ in range(total_pages)]
+    for name in sorted(costs, key=lambda name: (-costs[name], name)):
+        load, page = heapq.heappop(heap)
+        shards[page].append(name)
+        heapq.heappush(heap, (load + costs[name], page))
+    return [sorted(shard) for shard in shards]
+
+
+def paginate_recipe_list(recipes, total_pages=TOTAL_PAGES, current_page=CURRENT_PAGE, mode=SHARD_MODE,
+                         shard_costs=SHARD_COSTS):
+    # recipes: {name: [reference, ...]} -> the names of the current page only
+    if not total_pages or not current_page:
+        return recipes
+    if mode == "count":
+        shards = count_shards(recipes.keys(), total_pages)
+    elif mode == "cost":
+        # pages computed from different costs would overlap, so a local, changing file is never used
+        if not shard_costs:
+            raise Exception("CONAN_SHARD_MODE=cost needs CONAN_SHARD_COSTS, a costs snapshot read by every page")
+        costs = PackageCosts(shard_costs)
+        shards = cost_shards({name: costs.cost(name, refs) for name, refs in recipes.items()}, total_pages)
+    else:
+        raise Exception("Unknown shard mode '{}', expected 'count' or 'cost'".format(mode))
+    return {name: recipes[name] for name in shards[current_page - 1]}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkQueue(object):
+    # Package names shared by the workers of one machine through a JSON file in folder.
+    # Every claim holds an exclusive lock on the file, so each package is taken once and
+    # a worker which becomes free takes the next one. A package stays claimed by the pid of
+    # its worker until the worker has uploaded its results and releases its claims; once the
+    # queue is empty, packages of workers which died before that are offered again, and the
+    # worker taking them over uploads their journaled results. The file is named after the day,
+    # a new run starts a new queue.
+
+    def __init__(self, folder, day=None):
+        # the workers of a queue usually start together
+        os.makedirs(folder, exist_ok=True)
+        day = day or datetime.date.today().strftime("%Y-%m-%d")
+        self.file_name = os.path.join(folder, "queue-{}.json".format(day))
+        self._lock_name = self.file_name + ".lock"
+
+    def _locked(self, update):
+        with open(self._lock_name, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = None
+                if os.path.exists(self.file_name):
+                    with open(self.file_name) as json_file:
+                        state = json.load(json_file)
+                state, result = update(state)
+                _save_json(self.file_name, state)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fill(self, names):
+        # only the first worker fills the queue, the others join it
+        def update(state):
+            return state or {"names": list(names), "next": 0}, None
+        self._locked(update)
+
+    def claim(self):
+        pid = os.getpid()
+
+        def update(state):
+            claimed = state.setdefault("claimed", {})
+            if state["next"] < len(state["names"]):
+                name = state["names"][state["next"]]
+                state["next"] += 1
+            else:
+                name = next((name for name, owner in sorted(claimed.items()) if not _alive(owner)), None)
+                if name is None:
+                    return state, None
+                logging.warning("Worker {} did not upload {}, taking it over".format(claimed[name], name))
+            claimed[name] = pid
+            return state, name
+        return self._locked(update)
+
+    def done(self, name):
+        def update(state):
+            state.setdefault("claimed", {}).pop(name, None)
+            return state, None
+        self._locked(update)
+
+    def release(self):
+        # every package claimed by this worker, once its results are uploaded
+        pid = os.getpid()
+
+        def update(state):
+            claimed = state.setdefault("claimed", {})
+            released = sorted(name for name, owner in claimed.items() if owner == pid)
+            for name in released:
+                del claimed[name]
+            return state, released
+        return self._locked(update)
+
+
+def iterate_recipes(recipes, costs=None, queue_folder=WORK_QUEUE):
+    # yields (name, references) of the packages this worker has to process
+    costs = costs or PackageCosts(None)
+    if not queue_folder:
+        recipes = paginate_recipe_list(recipes)
+        for name in sorted(recipes):
+            yield name, recipes[name]
+        return
+    queue = WorkQueue(queue_folder)
+    # most expensive first, so no worker is left with a long package at the end
+    queue.fill(sorted(recipes, key=lambda name: (-costs.cost(name, recipes[name]), name)))
+    while True:
+        name = queue.claim()
+        if name is None:
+            return
+        if name not in recipes:
+            queue.done(name)
+            continue
+        # the package stays claimed until release_recipes, after the upload: if the worker raises
+        # or dies before, it is offered again, finished or not
+        yield name, recipes[name]
+
+
+def release_recipes(queue_folder=WORK_QUEUE):
+    # call once the results of the packages from iterate_recipes are uploaded
+    if queue_folder:
+        return WorkQueue(queue_folder).release()
+    return []
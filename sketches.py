@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import base64
+import hashlib
+import numpy
+import pandas
+
+from interning import DICTIONARIES, IPV6_OFFSET, MISSING
+
+
+HLL_PRECISION = int(os.getenv("CONAN_HLL_PRECISION", 10))
+TOP_IPS = int(os.getenv("CONAN_TOP_IPS", 1000))
+SKETCHES_VERSION = 1
+
+
+def _splitmix64(values):
+    values = values.astype(numpy.uint64) + numpy.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return values ^ (values >> numpy.uint64(31))
+
+
+def ip_hashes(codes):
+    # Hashes must not depend on the run, so interned (IPv6) addresses are hashed by their text
+    codes = numpy.asarray(codes, dtype=numpy.int64)
+    with numpy.errstate(over='ignore'):
+        hashes = _splitmix64(codes)
+    for index in numpy.nonzero(codes >= IPV6_OFFSET)[0]:
+        text = DICTIONARIES['ip_address'].decode_one(codes[index])
+        hashes[index] = numpy.frombuffer(hashlib.blake2b(text.encode(), digest_size=8).digest(), dtype=numpy.uint64)[0]
+    return hashes
+
+
+def _leading_zeros(values):
+    values = values.copy()
+    zeros = numpy.zeros(len(values), dtype=numpy.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty = (values >> numpy.uint64(64 - shift)) == 0
+        zeros[empty] += shift
+        values[empty] <<= numpy.uint64(shift)
+    return zeros
+
+
+class HyperLogLog(object):
+    # Distinct count estimate with 2^precision one-byte registers, merged by register-wise max
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else numpy.zeros(1 << precision, dtype=numpy.uint8)
+
+    def add(self, hashes):
+        if not len(hashes):
+            return
+        index = (hashes >> numpy.uint64(64 - self.precision)).astype(numpy.int64)
+        # the guard bit bounds the rank when every remaining bit is zero
+        remaining = (hashes << numpy.uint64(self.precision)) | numpy.uint64(1 << (self.precision - 1))
+        numpy.maximum.at(self.registers, index, _leading_zeros(remaining) + 1)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise Exception("Can not merge HyperLogLog of precision {} and {}".format(self.precision, other.precision))
+        numpy.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / numpy.sum(numpy.power(2.0, -self.registers.astype(numpy.float64)))
+        empty = numpy.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * size and empty:
+            # linear counting is more accurate for small cardinalities
+            estimate = size * numpy.log(float(size) / empty)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {"precision": self.precision, "registers": base64.b64encode(self.registers.tobytes()).decode()}
+
+    @staticmethod
+    def from_dict(data):
+        registers = numpy.frombuffer(base64.b64decode(data["registers"]), dtype=numpy.uint8).copy()
+        return HyperLogLog(data["precision"], registers)
+
+
+class SpaceSaving(object):
+    # Top-K counts which never underestimate. Items that are not tracked have at most
+    # floor downloads, so merging two summaries fills missing items with their floor.
+
+    def __init__(self, capacity=TOP_IPS, counts=None, floor=0):
+        self.capacity = capacity
+        self.counts = counts if counts is not None else pandas.Series([], dtype=numpy.int64)
+        self.floor = floor
+
+    def merge_counts(self, counts, floor=0):
+        index = self.counts.index.union(counts.index)
+        merged = self.counts.reindex(index, fill_value=self.floor) + counts.reindex(index, fill_value=floor)
+        merged = merged.sort_values(ascending=False)
+        self.floor = self.floor + floor
+        if len(merged) > self.capacity:
+            self.floor = max(self.floor, int(merged.iloc[self.capacity]))
+            merged = merged.iloc[:self.capacity]
+        self.counts = merged.astype(numpy.int64)
+
+    def merge(self, other):
+        self.merge_counts(other.counts, other.floor)
+
+    def top(self, size):
+        return self.counts.iloc[:size]
+
+
+class IPSketches(object):
+    # Unique IPs per package and day, plus the heaviest downloading IPs.
+    # In memory IPs are interned codes; the JSON form uses the addresses, so sketches
+    # written by different jobs can be merged.
+
+    def __init__(self):
+        self.unique_ips = {}
+        self.top_ips = SpaceSaving()
+
+    def _add_unique(self, package, date, ip_codes):
+        ip_codes = numpy.asarray(ip_codes, dtype=numpy.int64)
+        ip_codes = ip_codes[ip_codes != MISSING]
+        key = "{}|{}".format(package, pandas.Timestamp(date).strftime("%Y-%m-%d"))
+        self.unique_ips.setdefault(key, HyperLogLog()).add(ip_hashes(numpy.unique(ip_codes)))
+
+    def add(self, package, date, ip_counts):
+        # all downloads of one package log, by IP code
+        self._add_unique(package, date, ip_counts.index.values)
+        self.top_ips.merge_counts(ip_counts[ip_counts.index != MISSING])
+
+    def merge(self, other):
+        for key, sketch in other.unique_ips.items():
+            if key in self.unique_ips:
+                self.unique_ips[key].merge(sketch)
+            else:
+                self.unique_ips[key] = HyperLogLog(sketch.precision, sketch.registers.copy())
+        self.top_ips.merge(other.top_ips)
+
+    def unique(self, package=None, start=None, end=None):
+        total = None
+        for key, sketch in self.unique_ips.items():
+            name, date = key.rsplit("|", 1)
+            if (package and name != package) or (start and date < start) or (end and date > end):
+                continue
+            if total is None:
+                total = HyperLogLog(sketch.precision)
+            total.merge(sketch)
+        return total.count() if total else 0
+
+    def top(self, size=20):
+        top = self.top_ips.top(size)
+        return pandas.Series(top.values, index=DICTIONARIES['ip_address'].decode(top.index.values), name='ip_address')
+
+    def to_dict(self):
+        top = self.top_ips.counts
+        return {
+            "version": SKETCHES_VERSION,
+            "unique_ips": {key: sketch.to_dict() for key, sketch in self.unique_ips.items()},
+            "top_ips": {
+                "capacity": self.top_ips.capacity,
+                "floor": int(self.top_ips.floor),
+                "counts": dict(zip(DICTIONARIES['ip_address'].decode(top.index.values), [int(count) for count in top.values])),
+            },
+        }
+
+    @staticmethod
+    def from_dict(data):
+        if data.get("version") != SKETCHES_VERSION:
+            raise Exception("Unsupported sketches version: {}".format(data.get("version")))
+        sketches = IPSketches()
+        sketches.unique_ips = {key: HyperLogLog.from_dict(value) for key, value in data["unique_ips"].items()}
+        top = data["top_ips"]
+        addresses = list(top["counts"].keys())
+        codes = DICTIONARIES['ip_address'].encode(pandas.Series(addresses, dtype=object))
+        counts = pandas.Series([top["counts"][address] for address in addresses], index=codes, dtype=numpy.int64)
+        sketches.top_ips = SpaceSaving(top["capacity"], counts.sort_values(ascending=False), top["floor"])
+        return sketches
+
+    def save(self, file_name):
+        with open(file_name, 'w') as json_file:
+            json.dump(self.to_dict(), json_file)
+        return file_name
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name) as json_file:
+            return IPSketches.from_dict(json.load(json_file))
+
+
+def merge_sketch_files(file_names):
+    total = IPSketches()
+    for file_name in file_names:
+        total.merge(IPSketches.load(file_name))
+    return total
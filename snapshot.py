@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import os
+import mmap
+import struct
+import numpy
+
+from download_cube import DownloadCube, CUBE_DIMENSIONS
+from interning import MISSING
+
+
+SNAPSHOT_MAGIC = b"CONANCUB"
+SNAPSHOT_VERSION = 1
+# magic, version, dimensions, cells, codes offset, counts offset, package index offset
+HEADER = struct.Struct("<8sIIQQQQ")
+# per dimension: values, string offsets offset, string data offset
+DIRECTORY = struct.Struct("<QQQ")
+ALIGNMENT = 8
+
+
+def _padding(position):
+    return b"\0" * (-position % ALIGNMENT)
+
+
+def write_snapshot(cube, file_name):
+    # Binary layout, little endian, every section aligned to 8 bytes:
+    #   header, dimension directory,
+    #   per dimension: uint64 string offsets (values + 1) and the UTF-8 values, sorted,
+    #   int32 codes (cells x dimensions) sorted by package first, int64 counts,
+    #   int64 package index: the cells of package code p are rows index[p]:index[p + 1]
+    # Written to a temporary file and renamed, readers never see a partial snapshot.
+    cube._compact()
+    columns = []
+    tables = []
+    for index, dimension in enumerate(CUBE_DIMENSIONS):
+        values = cube.dictionaries[dimension].values
+        order = sorted(range(len(values)), key=lambda code: values[code])
+        # codes are renumbered in string order, so lookups can bisect the string table
+        lookup = numpy.zeros(len(values) + 1, dtype=numpy.int32)
+        lookup[order] = numpy.arange(len(values), dtype=numpy.int32)
+        lookup[-1] = MISSING
+        columns.append(lookup[cube._codes[:, index]])
+        tables.append([values[code].encode("utf-8") for code in order])
+    codes = numpy.stack(columns, axis=1).reshape(-1, len(CUBE_DIMENSIONS)).astype('<i4')
+    rows = numpy.lexsort(codes.T[::-1])
+    codes = codes[rows]
+    counts = cube._counts[rows].astype('<i8')
+    package_index = numpy.searchsorted(codes[:, 0], numpy.arange(len(tables[0]) + 1), side='left').astype('<i8')
+
+    sections = []
+    position = HEADER.size + DIRECTORY.size * len(CUBE_DIMENSIONS)
+    directory = []
+    for table in tables:
+        offsets = numpy.zeros(len(table) + 1, dtype='<u8')
+        offsets[1:] = numpy.cumsum([len(value) for value in table])
+        data = b"".join(table)
+        directory.append(DIRECTORY.pack(len(table), position, position + offsets.nbytes))
+        sections.extend([offsets.tobytes(), data, _padding(position + offsets.nbytes + len(data))])
+        position += offsets.nbytes + len(data) + len(sections[-1])
+    codes_offset = position
+    counts_offset = codes_offset + codes.nbytes
+    index_offset = counts_offset + counts.nbytes
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(CUBE_DIMENSIONS), len(counts), codes_offset,
+                         counts_offset, index_offset)
+
+    temp_name = file_name + ".tmp"
+    with open(temp_name, "wb") as snapshot_file:
+        snapshot_file.write(header)
+        snapshot_file.write(b"".join(directory))
+        for section in sections:
+            snapshot_file.write(section)
+        snapshot_file.write(codes.tobytes())
+        snapshot_file.write(counts.tobytes())
+        snapshot_file.write(package_index.tobytes())
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_name, file_name)
+    return file_name
+
+
+class CubeSnapshot(object):
+    # Read only view of a snapshot written by write_snapshot. The file is mapped, not read:
+    # a lookup touches only the pages of the package it asks for, and every process mapping
+    # the same file shares one copy of it in the page cache.
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, dimensions, cells, codes_offset, counts_offset, index_offset = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or dimensions != len(CUBE_DIMENSIONS):
+            self._mmap.close()
+            raise Exception("Unsupported cube snapshot: {}".format(file_name))
+        self._tables = {}
+        for index, dimension in enumerate(CUBE_DIMENSIONS):
+            count, offsets_offset, data_offset = DIRECTORY.unpack_from(self._mmap, HEADER.size + DIRECTORY.size * index)
+            offsets = numpy.frombuffer(self._mmap, dtype='<u8', count=count + 1, offset=offsets_offset)
+            self._tables[dimension] = (offsets, data_offset)
+        self._codes = numpy.frombuffer(self._mmap, dtype='<i4', count=cells * dimensions,
+                                       offset=codes_offset).reshape(cells, dimensions)
+        self._counts = numpy.frombuffer(self._mmap, dtype='<i8', count=cells, offset=counts_offset)
+        self._package_index = numpy.frombuffer(self._mmap, dtype='<i8', count=len(self._tables['package'][0]),
+                                               offset=index_offset)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def value_count(self, dimension):
+        return len(self._tables[dimension][0]) - 1
+
+    def value(self, dimension, code):
+        if code == MISSING:
+            return None
+        offsets, data_offset = self._tables[dimension]
+        return self._mmap[data_offset + int(offsets[code]):data_offset + int(offsets[code + 1])].decode("utf-8")
+
+    def values(self, dimension):
+        return [self.value(dimension, code) for code in range(self.value_count(dimension))]
+
+    def code(self, dimension, value):
+        # binary search of the sorted string table, None when the value is unknown
+        low, high = 0, self.value_count(dimension)
+        while low < high:
+            middle = (low + high) // 2
+            if self.value(dimension, middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.value_count(dimension) and self.value(dimension, low) == value else None
+
+    def packages(self):
+        return self.values('package')
+
+    def _rows(self, packages):
+        if packages is None:
+            return [slice(0, len(self._counts))]
+        rows = []
+        for package in ([packages] if isinstance(packages, str) else packages):
+            code = self.code('package', package)
+            if code is not None:
+                rows.append(slice(int(self._package_index[code]), int(self._package_index[code + 1])))
+        return rows
+
+    def total(self, packages=None):
+        return int(sum(self._counts[rows].sum() for rows in self._rows(packages)))
+
+    def cube(self, packages=None):
+        # the cells of the given packages (all when None) as a DownloadCube, for its queries
+        rows = self._rows(packages)
+        codes = numpy.concatenate([self._codes[row] for row in rows]) if rows else self._codes[:0]
+        counts = numpy.concatenate([self._counts[row] for row in rows]) if rows else self._counts[:0]
+        cube = DownloadCube()
+        columns = []
+        for index, dimension in enumerate(CUBE_DIMENSIONS):
+            used = numpy.unique(codes[:, index])
+            used = used[used != MISSING]
+            lookup = numpy.full(self.value_count(dimension) + 1, MISSING, dtype=numpy.int32)
+            for code in used:
+                lookup[code] = cube.dictionaries[dimension].code(self.value(dimension, code))
+            columns.append(lookup[codes[:, index]])
+        cube._codes = numpy.stack(columns, axis=1).reshape(-1, len(CUBE_DIMENSIONS)).astype(numpy.int32)
+        cube._counts = counts.astype(numpy.int64)
+        return cube
+
+    def close(self):
+        # views into the map must be released before it can be closed
+        self._codes = self._counts = self._package_index = self._tables = None
+        self._mmap.close()
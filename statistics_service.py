@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import glob
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+
+from download_cube import DownloadCube, CUBE_DIMENSIONS
+from rollups import Rollups, ROLLUPS_FILE, LEVELS
+
+
+SERVICE_HOST = os.getenv("CONAN_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("CONAN_SERVICE_PORT", "8080"))
+# folder where collect-results.py writes cube-total-<date>.json
+SERVICE_DATA = os.getenv("CONAN_SERVICE_DATA", ".")
+SERVICE_CACHE_SIZE = int(os.getenv("CONAN_SERVICE_CACHE_SIZE", "1024"))
+SERVICE_RELOAD_SECONDS = float(os.getenv("CONAN_SERVICE_RELOAD", "60"))
+# threads computing the slices, the event loop only parses requests and writes responses
+SERVICE_WORKERS = int(os.getenv("CONAN_SERVICE_WORKERS", "4"))
+STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+          500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class QueryError(Exception):
+    pass
+
+
+def latest_cube_file(folder):
+    # cube-total-YYYYMMDD.json, the newest day sorts last
+    files = sorted(glob.glob(os.path.join(folder, "cube-total-*.json")))
+    return files[-1] if files else None
+
+
+def data_signature(folder, rollups_file):
+    # changes whenever a new cube lands or a day is rolled up
+    signature = []
+    for file_name in (latest_cube_file(folder), rollups_file, rollups_file + "-wal"):
+        if file_name and os.path.exists(file_name):
+            signature.append((file_name, os.path.getmtime(file_name), os.path.getsize(file_name)))
+        else:
+            signature.append(None)
+    return tuple(signature)
+
+
+def parse_date(value, name):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise QueryError("{} must be YYYY-MM-DD, got '{}'".format(name, value))
+
+
+class ResultCache(object):
+    # Least recently used response bodies with their ETag, cleared on every reload
+
+    def __init__(self, size=SERVICE_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class StatisticsService(object):
+    # Serves slices of the latest download cube and of the country rollups as JSON:
+    #   /downloads?package=zlib&os=Linux,Windows&start=2019-06-01&group_by=version,arch
+    #   /countries?package=zlib:conan&level=week&start=2019-04-01
+    #   /packages, /health
+    # The data is loaded once and reloaded in the background when a new day lands. Queries run on
+    # a thread pool; the cache is only used from the event loop.
+
+    def __init__(self, folder=SERVICE_DATA, rollups_file=ROLLUPS_FILE, cache_size=SERVICE_CACHE_SIZE,
+                 reload_seconds=SERVICE_RELOAD_SECONDS, workers=SERVICE_WORKERS):
+        self.folder = folder
+        self.rollups_file = rollups_file
+        self.reload_seconds = reload_seconds
+        self.cache = ResultCache(cache_size)
+        self.cube = None
+        self.cube_file = None
+        self.has_rollups = False
+        self.signature = None
+        self.loaded = None
+        # bumped on every reload, results computed from older data are not cached
+        self.generation = 0
+        self._executor = ThreadPoolExecutor(workers)
+        self._local = threading.local()
+
+    async def reload(self):
+        signature = data_signature(self.folder, self.rollups_file)
+        if signature == self.signature:
+            return False
+        cube_file = latest_cube_file(self.folder)
+        if not self.signature or signature[0] != self.signature[0]:
+            cube = None
+            if cube_file:
+                # parsing the cube may take seconds, queries keep using the previous one meanwhile
+                cube = await asyncio.get_event_loop().run_in_executor(None, self._load_cube, cube_file)
+            self.cube, self.cube_file = cube, cube_file
+            logging.info("Loaded {} ({} cells)".format(cube_file, len(cube) if cube else 0))
+        self.has_rollups = os.path.exists(self.rollups_file)
+        # rollups are read from SQLite on every query, only the cached results are stale
+        self.signature = signature
+        self.loaded = datetime.utcnow()
+        self.generation += 1
+        self.cache.clear()
+        return True
+
+    @staticmethod
+    def _load_cube(cube_file):
+        cube = DownloadCube.load(cube_file)
+        # compacted once here, so queries never modify it
+        cube.total()
+        return cube
+
+    def _rollups(self):
+        # SQLite connections can not be shared between threads, each worker opens its own, read only,
+        # and keeps it until the service exits
+        rollups = getattr(self._local, "rollups", None)
+        if rollups is None:
+            rollups = self._local.rollups = Rollups(self.rollups_file, read_only=True)
+        return rollups
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            try:
+                await self.reload()
+            except Exception as error:
+                logging.error("Could not reload the statistics: {}".format(error))
+
+    def query_downloads(self, parameters):
+        if self.cube is None:
+            return 503, {"error": "no cube-total file found in {}".format(self.folder)}
+        filters = {}
+        for dimension in CUBE_DIMENSIONS:
+            if dimension in parameters:
+                filters[dimension] = parameters[dimension].split(",")
+        if "start" in parameters or "end" in parameters:
+            start = parse_date(parameters["start"], "start").strftime("%Y-%m-%d") if "start" in parameters else ""
+            end = parse_date(parameters["end"], "end").strftime("%Y-%m-%d") if "end" in parameters else "9999-99-99"
+            dates = [date for date in self.cube.dictionaries['date'].values if start <= date <= end]
+            filters['date'] = [date for date in filters.get('date', dates) if date in dates]
+        group_by = [dimension for dimension in parameters.get("group_by", "").split(",") if dimension]
+        unknown = [dimension for dimension in group_by if dimension not in CUBE_DIMENSIONS]
+        if unknown:
+            raise QueryError("Unknown dimensions {}, expected {}".format(unknown, CUBE_DIMENSIONS))
+        result = {"downloads": self.cube.total(filters)}
+        if group_by:
+            counts = self.cube.rollup(group_by, filters)
+            result["groups"] = [dict(zip(group_by, key if isinstance(key, tuple) else (key,)), downloads=int(downloads))
+                                for key, downloads in counts.items()]
+        return 200, result
+
+    def query_countries(self, parameters):
+        if not self.has_rollups:
+            return 503, {"error": "no rollups found in {}".format(self.rollups_file)}
+        if "package" not in parameters:
+            raise QueryError("package is required")
+        level = parameters.get("level", "day")
+        if level not in LEVELS:
+            raise QueryError("level must be one of {}".format(LEVELS))
+        start = parse_date(parameters["start"], "start") if "start" in parameters else None
+        end = parse_date(parameters["end"], "end") if "end" in parameters else None
+        table = self._rollups().query(parameters["package"], level, start=start, end=end, by_country=True)
+        periods = []
+        for period, row in table.iterrows():
+            countries = dict((country, int(downloads)) for country, downloads in row.items() if downloads)
+            periods.append({"period": period.strftime("%Y-%m-%d"), "downloads": sum(countries.values()),
+                            "countries": countries})
+        return 200, {"package": parameters["package"], "level": level, "periods": periods}
+
+    def query_packages(self, parameters):
+        return 200, {"cube": sorted(self.cube.dictionaries['package'].values) if self.cube else [],
+                     "rollups": self._rollups().packages() if self.has_rollups else []}
+
+    def health(self):
+        return {"cube": self.cube_file, "rollups": self.rollups_file if self.has_rollups else None,
+                "loaded": self.loaded.isoformat() if self.loaded else None, "cached": len(self.cache),
+                "cache_hits": self.cache.hits, "cache_misses": self.cache.misses}
+
+    async def respond(self, path, parameters):
+        # (status, body, etag), bodies of successful queries come from the cache when possible
+        if path == "/health":
+            return 200, json.dumps(self.health()).encode(), None
+        handler = {"/downloads": self.query_downloads, "/countries": self.query_countries,
+                   "/packages": self.query_packages}.get(path)
+        if handler is None:
+            return 404, json.dumps({"error": "unknown path {}".format(path)}).encode(), None
+        key = (path, tuple(sorted(parameters.items())))
+        entry = self.cache.get(key)
+        if entry is not None:
+            return 200, entry[0], entry[1]
+        generation = self.generation
+        try:
+            status, result = await asyncio.get_event_loop().run_in_executor(self._executor, handler, parameters)
+        except QueryError as error:
+            return 400, json.dumps({"error": str(error)}).encode(), None
+        except Exception as error:
+            logging.exception("Could not answer {} {}".format(path, parameters))
+            return 500, json.dumps({"error": str(error)}).encode(), None
+        body = json.dumps(result, sort_keys=True).encode()
+        if status != 200:
+            return status, body, None
+        # the ETag depends on the content only, so clients keep it across reloads that do not change their slice
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if generation == self.generation:
+            self.cache.put(key, (body, etag))
+        return status, body, etag
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                method, target, version = request_line.decode("latin-1").split()
+                url = urlsplit(target)
+                if method not in ("GET", "HEAD"):
+                    status, body, etag = 405, b'{"error": "only GET is supported"}', None
+                else:
+                    status, body, etag = await self.respond(url.path, dict(parse_qsl(url.query)))
+                if etag and headers.get("if-none-match") == etag:
+                    status, body = 304, b""
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                response = ["HTTP/1.1 {} {}".format(status, STATUS[status]), "Content-Type: application/json",
+                            "Content-Length: {}".format(len(body)), "Connection: {}".format(
+                                "keep-alive" if keep_alive else "close")]
+                if etag:
+                    response.append("ETag: {}".format(etag))
+                writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError) as error:
+            logging.debug("Dropped connection: {}".format(error))
+        finally:
+            writer.close()
+
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        await self.reload()
+        server = await asyncio.start_server(self.handle, host, port)
+        logging.info("Serving statistics on http://{}:{}".format(host, port))
+        watcher = asyncio.ensure_future(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self._executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the latest download statistics as JSON")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--data", default=SERVICE_DATA, help="folder of the cube-total-<date>.json files")
+    parser.add_argument("--rollups", default=ROLLUPS_FILE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(StatisticsService(args.data, args.rollups).serve(args.host, args.port))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import argparse
+import functools
+from datetime import datetime, timedelta
+
+import numpy
+import pandas
+
+
+OPERATING_SYSTEMS = ["Linux", "Windows", "Macos"]
+ARCHITECTURES = ["x86_64", "x86", "armv7", "armv8"]
+COMPILERS = {
+    "Linux": [("gcc", ["5", "6", "7", "8", "9"]), ("clang", ["6.0", "7.0", "8"])],
+    "Windows": [("Visual Studio", ["14", "15", "16"])],
+    "Macos": [("apple-clang", ["9.1", "10.0"])],
+}
+BUILD_TYPES = ["Release", "Debug"]
+COUNTRIES = ["US", "DE", "BR", "CN", "IN", "FR", "GB", "JP", "RU", "ES"]
+# Bintray serves the recipe files next to the binaries
+EXPORT_FILES = ["conanfile.py", "conanmanifest.txt", "conan_export.tgz", "conan_sources.tgz"]
+
+
+class SyntheticCatalog(object):
+    # Packages, versions and binaries with random settings. The same seed always gives the
+    # same catalog, so logs and settings generated separately match.
+
+    def __init__(self, packages=20, versions=3, binaries=10, user="conan", channel="stable", seed=0):
+        random = numpy.random.RandomState(seed)
+        self.user = user
+        self.channel = channel
+        self.packages = {}
+        for package in range(packages):
+            name = "package{:04d}".format(package)
+            self.packages[name] = {}
+            for version in range(versions):
+                version = "{}.{}.{}".format(1 + package % 3, version, package % 7)
+                self.packages[name][version] = {}
+                for binary in range(binaries):
+                    package_id = hashlib.sha1("{}/{}/{}".format(name, version, binary).encode()).hexdigest()
+                    os_name = OPERATING_SYSTEMS[random.randint(len(OPERATING_SYSTEMS))]
+                    compiler, compiler_versions = COMPILERS[os_name][random.randint(len(COMPILERS[os_name]))]
+                    self.packages[name][version][package_id] = {
+                        "os": os_name,
+                        "arch": ARCHITECTURES[random.randint(len(ARCHITECTURES))],
+                        "compiler": compiler,
+                        "compiler.version": compiler_versions[random.randint(len(compiler_versions))],
+                        "build_type": BUILD_TYPES[random.randint(len(BUILD_TYPES))],
+                    }
+
+    def reference(self, name, version):
+        return "{}/{}@{}/{}".format(name, version, self.user, self.channel)
+
+    def search_packages(self, name):
+        # the items of ConanAPI.search_packages, one per reference
+        return [{"recipe": {"id": self.reference(name, version)},
+                 "packages": [{"id": package_id, "settings": settings} for package_id, settings in binaries.items()]}
+                for version, binaries in sorted(self.packages[name].items())]
+
+    def recipes(self):
+        return [self.reference(name, version) for name, versions in sorted(self.packages.items())
+                for version in sorted(versions)]
+
+
+def _zipf_choice(random, size, count, exponent=1.2):
+    # a few values take most of the rows, like the heaviest IPs or the latest versions
+    weights = 1.0 / numpy.arange(1, count + 1) ** exponent
+    return random.choice(count, size=size, p=weights / weights.sum())
+
+
+@functools.lru_cache()
+def _ipv4_addresses(count):
+    # count public looking addresses, spread over the IPv4 space
+    values = (numpy.arange(count, dtype=numpy.int64) * 2654435761 + 0x0B000000) % 0xDF000000 + 0x01000000
+    return numpy.array(["{}.{}.{}.{}".format(value >> 24, (value >> 16) & 255, (value >> 8) & 255, value & 255)
+                        for value in values], dtype=object)
+
+
+@functools.lru_cache()
+def _ipv6_addresses(count):
+    return numpy.array(["2001:db8::{:x}".format(code) for code in range(count)], dtype=object)
+
+
+def generate_frame(random, catalog, name, rows, ip_count=50000, ipv6_ratio=0.02):
+    # rows of the download log of one package: ip_address, country, path_information
+    versions = sorted(catalog.packages[name])
+    binaries = [(version, package_id) for version in versions for package_id in sorted(catalog.packages[name][version])]
+    binary = _zipf_choice(random, rows, len(binaries))
+    prefix = "/{0}/public-conan/{0}/{1}/".format(catalog.user, name)
+    package_paths = numpy.array(["{}{}/{}/0/package/{}/0/conan_package.tgz".format(prefix, version, catalog.channel,
+                                                                                  package_id)
+                                 for version, package_id in binaries], dtype=object)
+    export_paths = numpy.array(["{}{}/{}/0/export/{}".format(prefix, version, catalog.channel, file_name)
+                                for version in versions for file_name in EXPORT_FILES], dtype=object)
+    paths = package_paths[binary]
+    export = random.random_sample(rows) < 0.2
+    paths[export] = export_paths[random.randint(len(export_paths), size=int(export.sum()))]
+
+    ip_codes = _zipf_choice(random, rows, ip_count, exponent=0.9)
+    ip_addresses = _ipv4_addresses(ip_count)[ip_codes]
+    ipv6 = random.random_sample(rows) < ipv6_ratio
+    ip_addresses[ipv6] = _ipv6_addresses(ip_count)[ip_codes[ipv6]]
+    countries = numpy.array(COUNTRIES, dtype=object)[_zipf_choice(random, rows, len(COUNTRIES))]
+    return pandas.DataFrame({"ip_address": ip_addresses, "country": countries, "path_information": paths,
+                             "size": random.randint(1000, 10 ** 7, size=rows)})
+
+
+def generate_log(file_name, catalog, name, rows, seed=0, chunk_size=1000000):
+    # written chunk by chunk, so 100M rows need no more memory than chunk_size rows
+    random = numpy.random.RandomState(seed)
+    with gzip.open(file_name, "wt", compresslevel=1) as log_file:
+        for start in range(0, max(rows, 1), chunk_size):
+            frame = generate_frame(random, catalog, name, min(chunk_size, rows - start))
+            frame.to_csv(log_file, index=False, header=start == 0)
+    return file_name
+
+
+def generate_dataset(folder, rows, catalog, days=3, end=None, seed=0):
+    # <folder>/<package>/downloads-DD-MM-YYYY.csv.gz, rows split between packages and days,
+    # <folder>/settings.json with the binaries of every package
+    end = end or datetime.utcnow() - timedelta(days=1)
+    names = sorted(catalog.packages)
+    shares = 1.0 / numpy.arange(1, len(names) + 1)
+    package_rows = numpy.maximum((shares / shares.sum() * rows).astype(int), 1)
+    for index, name in enumerate(names):
+        package_folder = os.path.join(folder, name)
+        if os.path.isdir(package_folder):
+            shutil.rmtree(package_folder)
+        os.makedirs(package_folder)
+        for day in range(days):
+            date = (end - timedelta(days=day)).strftime("%d-%m-%Y")
+            generate_log(os.path.join(package_folder, "downloads-{}.csv.gz".format(date)), catalog, name,
+                         int(package_rows[index] // days) or 1, seed=seed + index * days + day)
+    with open(os.path.join(folder, "settings.json"), "w") as json_file:
+        json.dump({name: catalog.search_packages(name) for name in names}, json_file)
+    return folder
+
+
+class LocalBintray(object):
+    # Serves the logs of a generated dataset through the Bintray calls used by LogFetcher
+
+    BINTRAY_URL = "file://localhost"
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def get_list_package_download_log_files(self, subject, repo, package):
+        return [{"name": name} for name in sorted(os.listdir(os.path.join(self.folder, package)))]
+
+    def download_package_download_log_file(self, subject, repo, package, remote_log_name, local_log_name):
+        shutil.copyfile(os.path.join(self.folder, package, remote_log_name), local_log_name)
+
+
+class LocalLogSource(object):
+    # The log source interface of log_sources.py over a generated dataset
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def list_logs(self, subject, repo, package):
+        return sorted(os.listdir(os.path.join(self.folder, package.split(":")[0])))
+
+    def download_log(self, subject, repo, package, file):
+        return os.path.join(self.folder, package.split(":")[0], file)
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Bintray download logs")
+    parser.add_argument("folder")
+    parser.add_argument("--rows", type=int, default=10000, help="rows of all logs together")
+    parser.add_argument("--packages", type=int, default=20)
+    parser.add_argument("--versions", type=int, default=3)
+    parser.add_argument("--binaries", type=int, default=10, help="package ids per version")
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_dataset(args.folder, args.rows, SyntheticCatalog(args.packages, args.versions, args.binaries, seed=args.seed),
+                     args.days, seed=args.seed)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bintray_client
+from bintray.bintray import Bintray
+
+
+class BintrayStub(object):
+    # The Bintray REST calls used by the scripts, served from memory:
+    #   logs: {package: {file: content}}, packages missing here answer 404 to their listing
+    #   files: {package: {path: (version, content)}}, the uploaded files
+    #   failures: {path: [status, ...]} answered, in order, before the path works normally
+    #   requests: every (method, path) received
+
+    def __init__(self):
+        self.logs = {}
+        self.files = {}
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def failure(self, method, path):
+        with self.lock:
+            self.requests.append((method, path))
+            statuses = self.failures.get(path)
+            return statuses.pop(0) if statuses else None
+
+    def get(self, path):
+        # /packages/<subject>/<repo>/<package>/logs[/<file>] or /packages/<subject>/<repo>/<package>/files
+        parts = path.strip("/").split("/")
+        if len(parts) == 5 and parts[0] == "packages" and parts[4] == "files":
+            return 200, [{"name": os.path.basename(name), "path": name, "version": version, "size": len(content),
+                          "sha1": hashlib.sha1(content).hexdigest(), "sha256": hashlib.sha256(content).hexdigest()}
+                         for name, (version, content) in sorted(self.files.get(parts[3], {}).items())]
+        if len(parts) >= 5 and parts[0] == "packages" and parts[4] == "logs":
+            package = parts[3]
+            if package not in self.logs:
+                return 404, {"message": "Package '{}' was not found".format(package)}
+            if len(parts) == 5:
+                return 200, [{"name": name, "size": len(content)} for name, content in sorted(self.logs[package].items())]
+            if parts[5] in self.logs[package]:
+                return 200, self.logs[package][parts[5]]
+        return 404, {"message": "Not found"}
+
+    def put(self, path, body):
+        # /content/<subject>/<repo>/<package>/<version>/<path>
+        parts = path.strip("/").split("/", 5)
+        if len(parts) < 6 or parts[0] != "content":
+            return 404, {"message": "Not found"}
+        with self.lock:
+            self.files.setdefault(parts[3], {})[parts[5]] = (parts[4], body)
+        return 201, {"message": "success"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _send(self, status, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _answer(self, method, answer, *arguments):
+        path = urlsplit(self.path).path
+        status = self.server.stub.failure(method, path)
+        if status:
+            return self._send(status, {"message": "injected failure"})
+        self._send(*answer(path, *arguments))
+
+    def do_GET(self):
+        self._answer("GET", self.server.stub.get)
+
+    def do_PUT(self):
+        # the whole body is read first, also when the request is failed
+        self._answer("PUT", self.server.stub.put, self._body())
+
+
+@pytest.fixture
+def bintray_stub(monkeypatch):
+    # a BintrayStub on a free local port, the Bintray client pointed to it and retrying without delay
+    stub = BintrayStub()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.stub = stub
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(Bintray, "BINTRAY_URL", "http://127.0.0.1:{}".format(server.server_address[1]))
+    monkeypatch.setattr(bintray_client, "BINTRAY_BACKOFF_FACTOR", 0.01)
+    yield stub
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def bintray(bintray_stub):
+    return bintray_client.create_bintray("user", "key")
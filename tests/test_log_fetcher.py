@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import os
+import gzip
+
+from log_fetcher import LogFetcher, fetch_package_logs
+
+
+def log_content(rows):
+    return gzip.compress("".join("10.0.0.{},US\n".format(row) for row in range(rows)).encode())
+
+
+def count_rows(local_name, package):
+    # runs in a worker process
+    with gzip.open(local_name, "rt") as log_file:
+        return os.path.basename(local_name), len(log_file.readlines())
+
+
+def run_fetch(bintray, folder, targets):
+    consumed = {}
+    finished = []
+
+    def consume(target, result):
+        consumed.setdefault(target[2], []).append(result)
+
+    fetcher = LogFetcher(bintray, str(folder))
+    fetch_package_logs(fetcher, targets, count_rows, consume, finished.append, fetch_workers=2, parse_workers=1)
+    return consumed, finished
+
+
+def test_fetch_package_logs(bintray_stub, bintray, tmpdir):
+    bintray_stub.logs = {
+        "zlib:conan": {"downloads-01-06-2019.csv.gz": log_content(3), "downloads-02-06-2019.csv.gz": log_content(5)},
+        "bzip2:conan": {"downloads-01-06-2019.csv.gz": log_content(2)},
+    }
+    targets = [("conan", "conan", "zlib:conan"), ("conan", "conan", "bzip2:conan")]
+    consumed, finished = run_fetch(bintray, tmpdir, targets)
+    assert sorted(consumed["zlib:conan"]) == [("downloads-01-06-2019.csv.gz", 3), ("downloads-02-06-2019.csv.gz", 5)]
+    assert consumed["bzip2:conan"] == [("downloads-01-06-2019.csv.gz", 2)]
+    assert sorted(finished) == sorted(targets)
+
+
+def test_fetch_package_logs_failed_list(bintray_stub, bintray, tmpdir):
+    # a package that can not be listed is skipped, the others are not affected
+    bintray_stub.logs = {"zlib:conan": {"downloads-01-06-2019.csv.gz": log_content(3)}}
+    consumed, finished = run_fetch(bintray, tmpdir, [("conan", "conan", "missing:conan"),
+                                                      ("conan", "conan", "zlib:conan")])
+    assert consumed == {"zlib:conan": [("downloads-01-06-2019.csv.gz", 3)]}
+    assert finished == [("conan", "conan", "zlib:conan")]
+
+
+def test_fetch_package_logs_failed_download(bintray_stub, bintray, tmpdir):
+    # the package is still finished once its other logs are parsed
+    bintray_stub.logs = {"zlib:conan": {"downloads-01-06-2019.csv.gz": log_content(3),
+                                        "downloads-02-06-2019.csv.gz": log_content(5)}}
+    bintray_stub.failures["/packages/conan/conan/zlib:conan/logs/downloads-02-06-2019.csv.gz"] = [404]
+    consumed, finished = run_fetch(bintray, tmpdir, [("conan", "conan", "zlib:conan")])
+    assert consumed == {"zlib:conan": [("downloads-01-06-2019.csv.gz", 3)]}
+    assert finished == [("conan", "conan", "zlib:conan")]
+
+
+def test_fetch_package_logs_retried_download(bintray_stub, bintray, tmpdir):
+    path = "/packages/conan/conan/zlib:conan/logs/downloads-01-06-2019.csv.gz"
+    bintray_stub.logs = {"zlib:conan": {"downloads-01-06-2019.csv.gz": log_content(4)}}
+    bintray_stub.failures[path] = [503, 502]
+    consumed, finished = run_fetch(bintray, tmpdir, [("conan", "conan", "zlib:conan")])
+    assert consumed == {"zlib:conan": [("downloads-01-06-2019.csv.gz", 4)]}
+    assert bintray_stub.requests.count(("GET", path)) == 3
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from log_sources import RestLogSource, FallbackLogSource, BrowserLogSource, create_log_source
+
+
+class FakeBrowserSource(object):
+    # stands in for the browser, which can not run here
+
+    def __init__(self, folder, logs):
+        self.folder = folder
+        self.logs = logs
+        self.calls = []
+        self.closed = False
+
+    def list_logs(self, subject, repo, package):
+        self.calls.append(("list_logs", package))
+        return sorted(self.logs[package])
+
+    def download_log(self, subject, repo, package, file):
+        self.calls.append(("download_log", package, file))
+        local_name = os.path.join(self.folder, file)
+        with open(local_name, "wb") as log_file:
+            log_file.write(self.logs[package][file])
+        return local_name
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def sources(bintray_stub, bintray, tmpdir):
+    bintray_stub.logs = {"zlib:conan": {"downloads-01-06-2019.csv.gz": b"rest", "index.html": b""}}
+    browser = FakeBrowserSource(str(tmpdir.mkdir("browser")),
+                                {"private:conan": {"downloads-01-06-2019.csv.gz": b"browser"}})
+    return FallbackLogSource(RestLogSource(bintray, str(tmpdir.mkdir("rest"))), browser), browser
+
+
+def read(file_name):
+    with open(file_name, "rb") as log_file:
+        return log_file.read()
+
+
+def test_rest_source(bintray_stub, sources):
+    source, browser = sources
+    assert source.list_logs("conan", "conan", "zlib:conan") == ["downloads-01-06-2019.csv.gz"]
+    assert read(source.download_log("conan", "conan", "zlib:conan", "downloads-01-06-2019.csv.gz")) == b"rest"
+    assert browser.calls == []
+
+
+def test_fallback_on_failed_list(bintray_stub, sources):
+    # the REST listing answers 404, the package and its downloads go through the fallback
+    source, browser = sources
+    assert source.list_logs("conan", "conan", "private:conan") == ["downloads-01-06-2019.csv.gz"]
+    assert read(source.download_log("conan", "conan", "private:conan", "downloads-01-06-2019.csv.gz")) == b"browser"
+    assert browser.calls == [("list_logs", "private:conan"),
+                             ("download_log", "private:conan", "downloads-01-06-2019.csv.gz")]
+    assert ("GET", "/packages/conan/conan/private:conan/logs") in bintray_stub.requests
+
+
+def test_failed_download_is_not_routed_to_fallback(bintray_stub, sources):
+    # a package listed through REST keeps using it, its download errors are not hidden
+    source, browser = sources
+    source.list_logs("conan", "conan", "zlib:conan")
+    bintray_stub.failures["/packages/conan/conan/zlib:conan/logs/downloads-01-06-2019.csv.gz"] = [404]
+    with pytest.raises(Exception):
+        source.download_log("conan", "conan", "zlib:conan", "downloads-01-06-2019.csv.gz")
+    assert browser.calls == []
+
+
+def test_close(sources):
+    source, browser = sources
+    source.close()
+    assert browser.closed
+
+
+def test_create_log_source(bintray_stub):
+    assert isinstance(create_log_source("browser"), BrowserLogSource)
+    assert isinstance(create_log_source("rest", fallback=False), RestLogSource)
+    source = create_log_source("rest", fallback=True)
+    assert isinstance(source, FallbackLogSource)
+    source.close()
+    with pytest.raises(Exception):
+        create_log_source("ftp")
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+
+import pytest
+
+from uploads import UploadPipeline, check_uploads, file_digest
+
+
+def write(folder, name, content):
+    file_name = os.path.join(str(folder), name)
+    with open(file_name, "wb") as output:
+        output.write(content)
+    return file_name
+
+
+def pipeline(bintray, *file_names, **kwargs):
+    uploads = UploadPipeline(bintray, "conan", "public", "statistics", kwargs.get("version", "20190626"), workers=2)
+    for file_name in file_names:
+        uploads.add(file_name)
+    return uploads
+
+
+def puts(bintray_stub):
+    return [path for method, path in bintray_stub.requests if method == "PUT"]
+
+
+def test_upload_skips_unchanged(bintray_stub, bintray, tmpdir):
+    cube = write(tmpdir, "cube-20190626.json", b'{"zlib": 1}')
+    results = write(tmpdir, "results-20190626.jsonl", b'{"name": "zlib"}\n')
+    assert pipeline(bintray, cube, results).run() == {"cube-20190626.json": "uploaded",
+                                                      "results-20190626.jsonl": "uploaded"}
+    assert bintray_stub.files["statistics"]["cube-20190626.json"] == ("20190626", b'{"zlib": 1}')
+
+    # a restarted run only sends the file that changed
+    write(tmpdir, "results-20190626.jsonl", b'{"name": "zlib"}\n{"name": "bzip2"}\n')
+    assert pipeline(bintray, cube, results).run() == {"cube-20190626.json": "unchanged",
+                                                      "results-20190626.jsonl": "uploaded"}
+    assert len(puts(bintray_stub)) == 3
+    assert bintray_stub.files["statistics"]["results-20190626.jsonl"][1] == b'{"name": "zlib"}\n{"name": "bzip2"}\n'
+
+
+def test_upload_other_version(bintray_stub, bintray, tmpdir):
+    cube = write(tmpdir, "cube.json", b'{"zlib": 1}')
+    pipeline(bintray, cube, version="20190625").run()
+    assert pipeline(bintray, cube, version="20190626").run() == {"cube.json": "uploaded"}
+
+
+def test_upload_failed_listing(bintray_stub, bintray, tmpdir):
+    # without the remote checksums every file is sent
+    cube = write(tmpdir, "cube.json", b'{"zlib": 1}')
+    pipeline(bintray, cube).run()
+    bintray_stub.failures["/packages/conan/public/statistics/files"] = [404]
+    assert pipeline(bintray, cube).run() == {"cube.json": "uploaded"}
+    assert len(puts(bintray_stub)) == 2
+
+
+def test_upload_retry_rewinds_file(bintray_stub, bintray, tmpdir):
+    content = os.urandom(1 << 20)
+    export = write(tmpdir, "conan-center-20190626.csv.gz", content)
+    path = "/content/conan/public/statistics/20190626/conan-center-20190626.csv.gz"
+    bintray_stub.failures[path] = [503]
+    assert pipeline(bintray, export).run() == {"conan-center-20190626.csv.gz": "uploaded"}
+    assert puts(bintray_stub) == [path, path]
+    # the second attempt sent the whole file again, not what was left after the first one
+    stored = bintray_stub.files["statistics"]["conan-center-20190626.csv.gz"][1]
+    assert hashlib.sha256(stored).hexdigest() == file_digest(export)
+
+
+def test_upload_failure_does_not_stop_others(bintray_stub, bintray, tmpdir):
+    cube = write(tmpdir, "cube.json", b'{"zlib": 1}')
+    results = write(tmpdir, "results.jsonl", b'{"name": "zlib"}\n')
+    bintray_stub.failures["/content/conan/public/statistics/20190626/cube.json"] = [403]
+    uploaded = pipeline(bintray, cube, results).run()
+    assert isinstance(uploaded["cube.json"], Exception)
+    assert uploaded["results.jsonl"] == "uploaded"
+    with pytest.raises(Exception, match="Could not upload cube.json"):
+        check_uploads(uploaded)
+    assert check_uploads(pipeline(bintray, cube, results).run()) == {"cube.json": "uploaded",
+                                                                     "results.jsonl": "unchanged"}
+
+
+def test_upload_same_name_once(bintray_stub, bintray, tmpdir):
+    cube = write(tmpdir, "cube.json", b'{"zlib": 1}')
+    assert pipeline(bintray, cube, cube).run() == {"cube.json": "uploaded"}
+    assert len(puts(bintray_stub)) == 1
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import span, count
+
+
+UPLOAD_WORKERS = int(os.getenv("CONAN_UPLOAD_WORKERS", 4))
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(file_name, algorithm="sha256"):
+    # read in chunks, large gzip exports are never held in memory
+    digest = hashlib.new(algorithm)
+    with open(file_name, "rb") as file_content:
+        for chunk in iter(lambda: file_content.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_uploads(results):
+    # results of UploadPipeline.run, raises naming every failed file so the job exits non-zero
+    failed = [name for name, result in results.items() if isinstance(result, Exception)]
+    if failed:
+        raise Exception("Could not upload {}".format(", ".join(failed)))
+    return results
+
+
+class UploadPipeline(object):
+    # Uploads the artifacts of a run to one Bintray package version, several at a time over the
+    # pooled session of bintray_client. A file added twice under the same name is sent once, and
+    # files whose checksum matches the one Bintray lists for that version are not sent at all.
+    # Uploads are PUTs with override to a fixed path, so retrying one (the requester rewinds the
+    # streamed file) or running the whole pipeline again gives the same result.
+
+    def __init__(self, bintray, subject, repo, package, version, workers=UPLOAD_WORKERS):
+        self.bintray = bintray
+        self.subject = subject
+        self.repo = repo
+        self.package = package
+        self.version = version
+        self.workers = workers
+        self._files = OrderedDict()
+
+    def add(self, file_name, remote_name=None):
+        remote_name = remote_name or os.path.basename(file_name)
+        previous = self._files.get(remote_name)
+        if previous and os.path.abspath(previous) != os.path.abspath(file_name):
+            logging.warning("{} replaces {} as {}".format(file_name, previous, remote_name))
+        self._files[remote_name] = file_name
+        return remote_name
+
+    def _remote_checksums(self):
+        # {path: {"sha256": ..., "sha1": ...}} of the files already in this version
+        try:
+            files = self.bintray.get_package_files(self.subject, self.repo, self.package, include_unpublished=True)
+        except Exception as error:
+            logging.warning("Could not list {}/{}/{} ({}), uploading every file".format(self.subject, self.repo,
+                                                                                      self.package, error))
+            return {}
+        return dict((file.get("path") or file["name"], file) for file in files
+                    if "name" in file and file.get("version") == self.version)
+
+    def _unchanged(self, file_name, remote):
+        if not remote or remote.get("size") not in (None, os.path.getsize(file_name)):
+            return False
+        for algorithm in ("sha256", "sha1"):
+            if remote.get(algorithm):
+                return remote[algorithm] == file_digest(file_name, algorithm)
+        return False
+
+    def _upload(self, remote_name, file_name, remote):
+        with span("upload", file=remote_name) as timing:
+            if self._unchanged(file_name, remote):
+                logging.info("{} is unchanged, not uploaded".format(remote_name))
+                count("uploads_skipped")
+                return "unchanged"
+            logging.info("Uploading {}".format(remote_name))
+            self.bintray.upload_content(self.subject, self.repo, self.package, self.version, remote_name, file_name,
+                                        override=True)
+            timing.add("bytes", os.path.getsize(file_name))
+            return "uploaded"
+
+    def run(self):
+        # {remote name: "uploaded", "unchanged" or the error}, one failed file does not stop the others
+        if not self._files:
+            return {}
+        remote = self._remote_checksums()
+        results = OrderedDict()
+        with ThreadPoolExecutor(max(1, min(self.workers, len(self._files)))) as executor:
+            futures = [(remote_name, executor.submit(self._upload, remote_name, file_name, remote.get(remote_name)))
+                       for remote_name, file_name in self._files.items()]
+            for remote_name, future in futures:
+                try:
+                    results[remote_name] = future.result()
+                except Exception as error:
+                    logging.error("Could not upload {}: {}".format(remote_name, error))
+                    results[remote_name] = error
+        self._files.clear()
+        return results
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import uuid
+import shutil
+import pyarrow.parquet as pq
+from datetime import datetime
+
+
+WAREHOUSE_FOLDER = os.getenv("CONAN_WAREHOUSE", os.path.join(os.path.expanduser("~"), ".conan-statistics", "warehouse"))
+
+
+class Warehouse(object):
+    # Parquet store of parsed download events, one partition per package and day:
+    # <folder>/package=<package>/date=<YYYY-MM-DD>/events.parquet
+    # Partitions of past days are immutable, so they are only ever written once.
+
+    def __init__(self, folder=WAREHOUSE_FOLDER):
+        self.folder = folder
+
+    def _partition(self, package, date):
+        return os.path.join(self.folder, "package={}".format(package), "date={}".format(date.strftime("%Y-%m-%d")))
+
+    def has_partition(self, package, date):
+        return os.path.exists(os.path.join(self._partition(package, date), "events.parquet"))
+
+    def append(self, package, date, events_file):
+        # events_file: the Parquet events of a parsed log, see download_logs.ParsedLog
+        # the current day is still growing, it is written once complete
+        if date.date() >= datetime.utcnow().date() or self.has_partition(package, date):
+            return False
+        folder = self._partition(package, date)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        temp_name = os.path.join(folder, ".{}.tmp".format(uuid.uuid4().hex))
+        shutil.copyfile(events_file, temp_name)
+        os.replace(temp_name, os.path.join(folder, "events.parquet"))
+        return True
+
+    def partitions(self):
+        # (package, date) of every partition written
+        if not os.path.isdir(self.folder):
+            return
+        for package_folder in sorted(os.listdir(self.folder)):
+            if not package_folder.startswith("package="):
+                continue
+            for date_folder in sorted(os.listdir(os.path.join(self.folder, package_folder))):
+                if date_folder.startswith("date=") and \
+                   os.path.exists(os.path.join(self.folder, package_folder, date_folder, "events.parquet")):
+                    yield package_folder[len("package="):], datetime.strptime(date_folder[len("date="):], "%Y-%m-%d")
+
+    def read(self, columns=None, packages=None, start=None, end=None):
+        # Only the requested columns are read; package and date filters prune whole partitions
+        filters = []
+        if packages:
+            filters.append(('package', 'in', list(packages)))
+        if start:
+            filters.append(('date', '>=', start.strftime("%Y-%m-%d")))
+        if end:
+            filters.append(('date', '<=', end.strftime("%Y-%m-%d")))
+        table = pq.read_table(self.folder, columns=columns, filters=filters or None)
+        return table.to_pandas()
+
+    def _pivot(self, column, **filters):
+        pd_frame = self.read(columns=[column], **filters)
+        return pd_frame.groupby(column, observed=True).size()
+
+    def package_pivot(self, **filters):
+        return self._pivot('package', **filters)
+
+    def country_pivot(self, **filters):
+        return self._pivot('country', **filters)
+
+    def ip_pivot(self, **filters):
+        return self._pivot('ip_address', **filters)